@@ -0,0 +1,428 @@
+"""Offline throughput benchmark for bot.py
+
+Runs transfer_range against an in-process fake Client with simulated latency, bandwidth,
+FloodWaits, forward restrictions, albums, sparse ID ranges and forum topics, with BATCH_FORWARD,
+SCAN_MODE=server and STREAM_UPLOAD scenarios. No network or account needed.
+
+    python benchmarks/bench_transfer.py
+    python benchmarks/bench_transfer.py --json results.json
+    python benchmarks/bench_transfer.py --compare results.json --tolerance 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# bot.py reads its config at import time and creates sessions/ and downloads/ in the working directory
+CALLER_DIR = os.getcwd()
+WORKDIR = tempfile.mkdtemp(prefix="tg_bench_")
+os.chdir(WORKDIR)
+os.environ.update({
+    "API_ID": "1",
+    "API_HASH": "bench",
+    "SOURCES": "",
+    "DESTINATIONS": "",
+    # The benchmark measures the pipeline, not the pacing
+    "SEND_RATE": "1000",
+    "SEND_RATE_MAX": "1000",
+    "ACCOUNT_RATE": "1000",
+    "TQDM_DISABLE": "1",
+})
+sys.path.insert(0, ROOT)
+
+import bot
+from pyrogram import raw, utils
+from pyrogram.client import Cache
+from pyrogram.errors import FloodWait, ChatForwardsRestricted
+from pyrogram.types import InputMediaVideo
+
+SOURCE_ID = -1001000000001
+# Forum scenarios transfer the topic rooted at this message
+TOPIC_ID = 1
+
+
+class FakeClient:
+    """Just enough of pyrogram.Client for transfer_range, with simulated costs. Signatures follow
+    pyrogram 2.0.106 and messages are raw TL objects parsed by pyrogram itself, like the real client does."""
+
+    def __init__(self, scenario, name="bench"):
+        self.name = name
+        self.scenario = scenario
+        self.calls = Counter()
+        self.sends = 0
+        self.next_id = 10 ** 6
+        # Upload file id -> bytes received through SaveFilePart, uploaded media id -> (kind, size)
+        self.upload_parts = Counter()
+        self.uploaded = {}
+        self.message_cache = Cache(10000)
+        self.rng = random.Random(scenario["seed"])
+        # Forum scenarios: message id -> id of its topic's root message
+        self.topics = {}
+        self.layout = self.build_layout()
+
+    def build_layout(self):
+        """message id -> (kind, grouped_id, size) for the scenario's ID range"""
+        s = self.scenario
+        layout = {}
+        # The first IDs of a forum are the service messages its topics are rooted at
+        message_id = s["topics"] + 1
+        while message_id <= s["messages"]:
+            if self.rng.random() > s["density"]:
+                message_id += 1
+                continue
+            topic = self.rng.randint(1, s["topics"]) if s["topics"] else None
+            if self.rng.random() < s["albums"]:
+                parts = self.rng.randint(2, 10)
+                for offset in range(parts):
+                    if message_id + offset <= s["messages"]:
+                        layout[message_id + offset] = self.media(message_id)
+                        self.topics[message_id + offset] = topic
+                message_id += parts
+                continue
+            kind = self.rng.choice(("photo", "video", "text"))
+            layout[message_id] = (kind, None, self.size(kind))
+            self.topics[message_id] = topic
+            message_id += 1
+        return layout
+
+    def media(self, grouped_id):
+        kind = "video" if self.rng.random() < 0.3 else "photo"
+        return kind, grouped_id, self.size(kind)
+
+    def size(self, kind):
+        return {"photo": self.scenario["photo_size"], "video": self.scenario["video_size"]}.get(kind, 0)
+
+    async def rpc(self, method, transfer_bytes=0):
+        self.calls[method] += 1
+        await asyncio.sleep(self.scenario["latency"] + transfer_bytes / self.scenario["bandwidth"])
+
+    async def send(self, method, transfer_bytes=0, forward=False):
+        """One sending RPC: forwards and copies fail on a protected source, every flood_every-th send gets a FloodWait"""
+        await self.rpc(method, transfer_bytes)
+        if forward and self.scenario["restricted"]:
+            raise ChatForwardsRestricted()
+        self.sends += 1
+        flood_every = self.scenario["flood_every"]
+        if flood_every and self.sends % flood_every == 0:
+            raise FloodWait(value=0)
+
+    # --- raw TL objects ---
+
+    def raw_media(self, kind, media_id, size):
+        if kind == "photo":
+            return raw.types.MessageMediaPhoto(photo=raw.types.Photo(
+                id=media_id, access_hash=1, file_reference=b"", date=0, dc_id=2, video_sizes=[],
+                sizes=[raw.types.PhotoSize(type="y", w=1280, h=1280, size=size)]
+            ))
+        if kind == "video":
+            return raw.types.MessageMediaDocument(document=raw.types.Document(
+                id=media_id, access_hash=1, file_reference=b"", date=0, dc_id=2, mime_type="video/mp4",
+                size=size, thumbs=[], video_thumbs=[],
+                attributes=[raw.types.DocumentAttributeVideo(duration=10, w=1280, h=1280)]
+            ))
+        return None
+
+    def raw_message(self, chat_id, message_id, kind, grouped_id=None, size=0, media_id=None, topic=None):
+        media = self.raw_media(kind, media_id or message_id, size)
+        return raw.types.Message(
+            id=message_id, peer_id=raw.types.PeerChannel(channel_id=utils.get_channel_id(chat_id)), date=0,
+            message="caption" if media else "text", media=media, entities=[], grouped_id=grouped_id,
+            reply_to=raw.types.MessageReplyHeader(reply_to_msg_id=topic, forum_topic=True) if topic else None
+        )
+
+    def source_message(self, chat_id, message_id):
+        if message_id <= self.scenario["topics"]:
+            return raw.types.MessageService(
+                id=message_id, peer_id=raw.types.PeerChannel(channel_id=utils.get_channel_id(chat_id)), date=0,
+                action=raw.types.MessageActionTopicCreate(title=f"topic {message_id}", icon_color=0)
+            )
+        if message_id not in self.layout:
+            return raw.types.MessageEmpty(id=message_id)
+        kind, grouped_id, size = self.layout[message_id]
+        return self.raw_message(chat_id, message_id, kind, grouped_id, size, topic=self.topics[message_id])
+
+    def raw_chats(self, *chat_ids):
+        return [
+            raw.types.Channel(id=utils.get_channel_id(chat_id), title="bench", photo=raw.types.ChatPhotoEmpty(),
+                              date=0, access_hash=1, restriction_reason=[], usernames=[],
+                              noforwards=(self.scenario["restricted"] and chat_id == SOURCE_ID) or None)
+            for chat_id in chat_ids
+        ]
+
+    def new_messages(self, chat_id, media):
+        """Raw messages created in chat_id, `media` holds (kind, media id, size) of each"""
+        messages = []
+        for kind, media_id, size in media:
+            self.next_id += 1
+            messages.append(self.raw_message(chat_id, self.next_id, kind, size=size, media_id=media_id))
+        return messages
+
+    async def sent(self, chat_id, media):
+        r = raw.types.messages.Messages(messages=self.new_messages(chat_id, media), users=[], chats=self.raw_chats(chat_id))
+        return await utils.parse_messages(self, r, replies=0)
+
+    def updates(self, chat_id, media):
+        return raw.types.Updates(
+            updates=[raw.types.UpdateNewChannelMessage(message=m, pts=0, pts_count=0)
+                     for m in self.new_messages(chat_id, media)],
+            users=[], chats=self.raw_chats(chat_id), date=0, seq=0
+        )
+
+    def source_media(self, message_ids):
+        """Forwarded and copied media keep the source's media id"""
+        return [(self.layout[i][0], i, self.layout[i][2]) for i in message_ids if i in self.layout]
+
+    def history_page(self, query):
+        """messages.getHistory/getReplies/search with add_offset=-limit: the next `limit` existing messages
+        from offset_id up, of one topic for getReplies and a search with top_msg_id"""
+        kinds = {
+            raw.types.InputMessagesFilterPhotos: ("photo",),
+            raw.types.InputMessagesFilterVideo: ("video",),
+            raw.types.InputMessagesFilterPhotoVideo: ("photo", "video"),
+        }.get(type(getattr(query, "filter", None)))
+        topic = query.msg_id if isinstance(query, raw.functions.messages.GetReplies) else getattr(query, "top_msg_id", None)
+        ids = [i for i in sorted(self.layout)
+               if max(query.offset_id, query.min_id + 1) <= i < query.max_id
+               and (kinds is None or self.layout[i][0] in kinds)
+               and (topic is None or self.topics[i] == topic)][:query.limit]
+        return raw.types.messages.ChannelMessages(
+            messages=[self.source_message(SOURCE_ID, i) for i in reversed(ids)],
+            chats=self.raw_chats(SOURCE_ID), users=[], pts=0, count=len(ids), topics=[]
+        )
+
+    # --- pyrogram.Client ---
+
+    def rnd_id(self):
+        return random.getrandbits(63)
+
+    async def resolve_peer(self, peer_id):
+        # Access hashes come from the local peer cache, no RPC
+        return raw.types.InputPeerChannel(channel_id=utils.get_channel_id(peer_id), access_hash=1)
+
+    async def invoke(self, query, retries=5, timeout=15, sleep_threshold=None):
+        method = type(query).__name__
+        if isinstance(query, (raw.functions.upload.SaveFilePart, raw.functions.upload.SaveBigFilePart)):
+            await self.rpc(method, len(query.bytes))
+            self.upload_parts[query.file_id] += len(query.bytes)
+            return True
+        if isinstance(query, raw.functions.messages.UploadMedia):
+            await self.rpc(method)
+            self.next_id += 1
+            kind = "photo" if isinstance(query.media, raw.types.InputMediaUploadedPhoto) else "video"
+            self.uploaded[self.next_id] = (kind, self.upload_parts.pop(query.media.file.id, 0))
+            return self.raw_media(kind, self.next_id, self.uploaded[self.next_id][1])
+        if isinstance(query, raw.functions.messages.SendMultiMedia):
+            await self.send(method)
+            media = [(*self.uploaded[m.media.id.id][:1], m.media.id.id, self.uploaded[m.media.id.id][1])
+                     for m in query.multi_media]
+            return self.updates(utils.MAX_CHANNEL_ID - query.peer.channel_id, media)
+        if isinstance(query, raw.functions.messages.ForwardMessages):
+            await self.send(method, forward=True)
+            return self.updates(utils.MAX_CHANNEL_ID - query.to_peer.channel_id, self.source_media(query.id))
+        if isinstance(query, (raw.functions.messages.GetHistory, raw.functions.messages.Search,
+                              raw.functions.messages.GetReplies)):
+            await self.rpc(method)
+            return self.history_page(query)
+        raise NotImplementedError(method)
+
+    async def get_messages(self, chat_id, message_ids=None, reply_to_message_ids=None, replies=1):
+        await self.rpc("get_messages")
+        if message_ids is None:
+            # The messages these ids reply to, the topic roots in a forum
+            is_iterable = not isinstance(reply_to_message_ids, int)
+            ids = [self.topics.get(i) or 0 for i in (reply_to_message_ids if is_iterable else [reply_to_message_ids])]
+        else:
+            is_iterable = not isinstance(message_ids, int)
+            ids = list(message_ids) if is_iterable else [message_ids]
+        r = raw.types.messages.Messages(messages=[self.source_message(chat_id, i) for i in ids],
+                                        users=[], chats=self.raw_chats(chat_id))
+        messages = await utils.parse_messages(self, r, replies=replies)
+        return messages if is_iterable else messages[0]
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, caption=None, parse_mode=None,
+                           caption_entities=None, disable_notification=None, reply_to_message_id=None,
+                           schedule_date=None, protect_content=None, reply_markup=None):
+        await self.send("copy_message", forward=True)
+        return (await self.sent(chat_id, self.source_media([message_id])))[0]
+
+    async def copy_media_group(self, chat_id, from_chat_id, message_id, captions=None, disable_notification=None,
+                               reply_to_message_id=None, schedule_date=None):
+        await self.send("copy_media_group", forward=True)
+        grouped_id = self.layout[message_id][1]
+        return await self.sent(chat_id, self.source_media(i for i in self.layout if self.layout[i][1] == grouped_id))
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, disable_notification=None,
+                               schedule_date=None, protect_content=None):
+        await self.send("forward_messages", forward=True)
+        is_iterable = not isinstance(message_ids, int)
+        sent = await self.sent(chat_id, self.source_media(message_ids if is_iterable else [message_ids]))
+        return sent if is_iterable else sent[0]
+
+    async def send_media_group(self, chat_id, media, disable_notification=None, reply_to_message_id=None,
+                               schedule_date=None, protect_content=None):
+        # Paths are uploaded, file_ids cost nothing
+        sizes = [os.path.getsize(m.media) if os.path.exists(str(m.media)) else 0 for m in media]
+        await self.send("send_media_group", sum(sizes))
+        new_media = []
+        for m, size in zip(media, sizes):
+            self.next_id += 1
+            new_media.append(("video" if isinstance(m, InputMediaVideo) else "photo", self.next_id, size))
+        return await self.sent(chat_id, new_media)
+
+    async def send_message(self, chat_id, text, parse_mode=None, entities=None, disable_web_page_preview=None,
+                           disable_notification=None, reply_to_message_id=None, schedule_date=None,
+                           protect_content=None, reply_markup=None):
+        await self.send("send_message")
+        return (await self.sent(chat_id, [("text", None, 0)]))[0]
+
+    async def download_media(self, message, file_name="downloads/", in_memory=False, block=True,
+                             progress=None, progress_args=()):
+        media = message.photo or message.video
+        await self.rpc("download", media.file_size)
+        os.makedirs(os.path.dirname(file_name) or ".", exist_ok=True)
+        with open(file_name, "wb") as f:
+            f.truncate(media.file_size)
+        return file_name
+
+    async def stream_media(self, message, limit=0, offset=0):
+        media = message.photo or message.video
+        chunk_size = 1024 * 1024
+        total = -(-media.file_size // chunk_size)
+        last = total if not limit else min(total, offset + limit)
+        await self.rpc("stream_media")
+        for index in range(offset, last):
+            chunk = min(chunk_size, media.file_size - index * chunk_size)
+            await asyncio.sleep(chunk / self.scenario["bandwidth"])
+            yield bytes(chunk)
+
+
+BASE = {
+    "seed": 1,
+    "messages": 400,
+    "density": 1.0,
+    "albums": 0.15,
+    "restricted": False,
+    "flood_every": 0,
+    "destinations": 1,
+    "latency": 0.005,
+    "bandwidth": 200 * 1024 * 1024,
+    # Forum topics the messages are spread over, the benchmark transfers the first one
+    "topics": 0,
+    "photo_size": 200 * 1024,
+    "video_size": 4 * 1024 * 1024,
+    # bot.py settings switched on for the scenario
+    "config": {},
+}
+
+SCENARIOS = {
+    "forward": {},
+    "forward_3_destinations": {"destinations": 3},
+    "restricted": {"restricted": True, "messages": 200},
+    "restricted_3_destinations": {"restricted": True, "messages": 200, "destinations": 3},
+    "sparse": {"messages": 2000, "density": 0.1},
+    "floodwait": {"messages": 200, "flood_every": 50},
+    "batch_forward": {"config": {"BATCH_FORWARD": True}},
+    "sparse_server_scan": {"messages": 2000, "density": 0.1, "config": {"SCAN_MODE": "server"}},
+    "restricted_stream_upload": {"restricted": True, "messages": 200, "config": {"STREAM_UPLOAD": True}},
+    "topic": {"messages": 800, "topics": 4},
+    "topic_server_scan": {"messages": 800, "topics": 4, "config": {"SCAN_MODE": "server"}},
+}
+
+
+def reset_state():
+    """Fresh journal, cache, limiter and metrics so scenarios don't influence each other"""
+    bot.journal.close()
+    bot.media_cache.close()
+    bot.RESTRICTED_CHATS.clear()
+    bot.journal = bot.TransferJournal(os.path.join(WORKDIR, f"journal_{time.monotonic_ns()}.db"))
+    bot.media_cache = bot.MediaCache(os.path.join(WORKDIR, f"media_cache_{time.monotonic_ns()}.db"),
+                                     bot.MEDIA_CACHE_DIR, bot.MEDIA_CACHE_MB * 1024 * 1024)
+    bot.limiter = bot.RateLimiter()
+    bot.metrics = bot.Metrics()
+
+
+async def run_scenario(name, overrides):
+    scenario = dict(BASE, **overrides)
+    reset_state()
+    client = FakeClient(scenario)
+    dest_chats = [(-1002000000000 - i, None) for i in range(scenario["destinations"])]
+
+    config = {key: getattr(bot, key) for key in scenario["config"]}
+    for key, value in scenario["config"].items():
+        setattr(bot, key, value)
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            source = (SOURCE_ID, TOPIC_ID if scenario["topics"] else None, name)
+            await bot.transfer_range(client, source, dest_chats, 1, scenario["messages"])
+        finally:
+            sys.stdout = stdout
+            for key, value in config.items():
+                setattr(bot, key, value)
+    elapsed = time.perf_counter() - started
+    bot.journal.flush()
+
+    _, totals = bot.metrics.summary()
+    groups = sum(value for (metric, labels), value in bot.metrics.counters.items()
+                 if metric == "groups_total" and dict(labels).get("status") == "done") // scenario["destinations"]
+    transferred = totals.get("download_bytes_total", 0) + totals.get("upload_bytes_total", 0)
+    api_calls = sum(client.calls.values())
+    return {
+        "groups": groups,
+        "seconds": round(elapsed, 3),
+        "groups_per_s": round(groups / elapsed, 2),
+        "mb_per_s": round(transferred / 1024 / 1024 / elapsed, 2),
+        "calls_per_group": round(api_calls / max(groups, 1), 2),
+        "calls": dict(client.calls),
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Names of scenarios whose groups/s fell more than `tolerance` below the baseline"""
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and result["groups_per_s"] < baseline[name]["groups_per_s"] * (1 - tolerance):
+            regressions.append(name)
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark for bot.py")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline results file, exit 1 on a groups/s regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed groups/s drop against --compare")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'scenario':<28}{'groups':>8}{'seconds':>10}{'groups/s':>10}{'MB/s':>10}{'calls/group':>13}")
+    for name in args.scenario or SCENARIOS:
+        result = await run_scenario(name, SCENARIOS[name])
+        results[name] = result
+        print(f"{name:<28}{result['groups']:>8}{result['seconds']:>10}{result['groups_per_s']:>10}"
+              f"{result['mb_per_s']:>10}{result['calls_per_group']:>13}")
+    bot.journal.close()
+    bot.media_cache.close()
+
+    if args.json:
+        with open(os.path.join(CALLER_DIR, args.json), "w") as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        regressions = compare(results, os.path.join(CALLER_DIR, args.compare), args.tolerance)
+        if regressions:
+            print(f"groups/s regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
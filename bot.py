@@ -1,16 +1,25 @@
 import os
+import sys
 import json
+import time
+import math
+import bisect
+import itertools
+import shutil
+import hashlib
+import sqlite3
 import asyncio
-import random
+import contextlib
 from dotenv import load_dotenv
-from pyrogram import Client
+from pyrogram import Client, raw, utils, filters
+from pyrogram.handlers import MessageHandler
 from pyrogram.errors import (
     PhoneCodeInvalid, PhoneCodeExpired, SessionPasswordNeeded,
     ChatForwardsRestricted, ChannelPrivate, ChatWriteForbidden, ChannelInvalid,
-    FloodWait, MediaEmpty, BadRequest
+    FloodWait, MediaEmpty, BadRequest, PeerIdInvalid
 )
 from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo
-from pyrogram.enums import ParseMode
+from pyrogram.enums import ParseMode, MessagesFilter
 from colorama import Fore, Style, init
 from tqdm import tqdm
 
@@ -35,6 +44,35 @@ DROP_CAPTION = os.getenv("DROP_CAPTION", "False").lower() == "true"
 SAVE_TO_LOCAL = os.getenv("SAVE_TO_LOCAL", "False").lower() == "true"
 FORWARDING = os.getenv("FORWARDING", "True").lower() == "true"
 FORWARDING_ONLY = os.getenv("FORWARDING_ONLY", "False").lower() == "true"
+PREFETCH_GROUPS = int(os.getenv("PREFETCH_GROUPS", "3"))
+PREFETCH_MAX_MB = int(os.getenv("PREFETCH_MAX_MB", "2048"))
+SEND_RATE = float(os.getenv("SEND_RATE", "0.5"))
+SEND_RATE_MAX = float(os.getenv("SEND_RATE_MAX", "5"))
+ACCOUNT_RATE = float(os.getenv("ACCOUNT_RATE", "1"))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "5"))
+BATCH_FORWARD = os.getenv("BATCH_FORWARD", "False").lower() == "true"
+FETCH_AHEAD = int(os.getenv("FETCH_AHEAD", "2"))
+SCAN_MODE = os.getenv("SCAN_MODE", "ids").lower()
+SHARD_SIZE = int(os.getenv("SHARD_SIZE", "1000"))
+SHARD_HANDOFF_SECONDS = int(os.getenv("SHARD_HANDOFF_SECONDS", "60"))
+MEDIA_CACHE = os.getenv("MEDIA_CACHE", "False").lower() == "true"
+MEDIA_CACHE_MB = int(os.getenv("MEDIA_CACHE_MB", "4096"))
+SKIP_DUPLICATES = os.getenv("SKIP_DUPLICATES", "False").lower() == "true"
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "False").lower() == "true"
+STREAM_BUFFER_MB = int(os.getenv("STREAM_BUFFER_MB", "8"))
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "4"))
+PARALLEL_DOWNLOAD_MIN_MB = int(os.getenv("PARALLEL_DOWNLOAD_MIN_MB", "20"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+PARALLEL_SOURCES = int(os.getenv("PARALLEL_SOURCES", "1"))
+FOLLOW_ALBUM_WAIT = float(os.getenv("FOLLOW_ALBUM_WAIT", "2"))
+FOLLOW_CATCHUP_SECONDS = int(os.getenv("FOLLOW_CATCHUP_SECONDS", "60"))
+PEER_CACHE_HOURS = float(os.getenv("PEER_CACHE_HOURS", "24"))
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+ARCHIVE_INDEX = os.getenv("ARCHIVE_INDEX", "False").lower() == "true"
+ARCHIVE_SHARD_SIZE = int(os.getenv("ARCHIVE_SHARD_SIZE", "1000"))
+DOWNLOAD_LIMIT_MBPS = float(os.getenv("DOWNLOAD_LIMIT_MBPS", "0"))
+UPLOAD_LIMIT_MBPS = float(os.getenv("UPLOAD_LIMIT_MBPS", "0"))
 
 # Parse chats
 def parse_chats(chat_str):
@@ -53,6 +91,19 @@ SOURCES = parse_chats(SOURCES_STR)
 DESTINATIONS = parse_chats(DESTINATIONS_STR)
 
 ACCOUNTS_FILE = os.path.join("sessions", "accounts.json")
+JOURNAL_FILE = os.path.join("sessions", "journal.db")
+PEERS_FILE = os.path.join("sessions", "peers.json")
+MEDIA_CACHE_FILE = os.path.join("sessions", "media_cache.db")
+MEDIA_CACHE_DIR = os.path.join("downloads", ".cache")
+
+# python bot.py --resume → skip groups the journal already marks as done
+RESUME = "--resume" in sys.argv
+
+# Chats known to block forwarding; Strategy 1 is skipped for these
+RESTRICTED_CHATS = set()
+
+# Sessions whose dialogs were already scanned in this run
+DIALOGS_LOADED = set()
 
 def load_accounts():
     if os.path.exists(ACCOUNTS_FILE):
@@ -80,6 +131,622 @@ def update_account_cache(session_name, user):
         accounts[session_name] = updated_info
         save_accounts(accounts)
 
+class PeerCache:
+    """Chats resolved by each session (id, access hash, title, checked topics), kept in peers.json for
+    PEER_CACHE_HOURS so a warm start needs neither the dialog scan nor a get_chat per chat"""
+
+    def __init__(self, path):
+        self.path = path
+        self._peers = None
+
+    @property
+    def peers(self):
+        if self._peers is None:
+            self._peers = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    try:
+                        self._peers = json.load(f)
+                    except ValueError:
+                        pass
+        return self._peers
+
+    def get(self, client, chat):
+        entry = self.peers.get(client.name, {}).get(str(chat))
+        if entry and time.time() - entry["resolved_at"] < PEER_CACHE_HOURS * 3600:
+            return entry
+        return None
+
+    async def add(self, client, chat, resolved):
+        peer = await client.resolve_peer(resolved.id)
+        if isinstance(peer, raw.types.InputPeerChannel):
+            peer_type, access_hash = "channel", peer.access_hash
+        elif isinstance(peer, raw.types.InputPeerUser):
+            peer_type, access_hash = "user", peer.access_hash
+        else:
+            peer_type, access_hash = "group", 0
+        self.peers.setdefault(client.name, {})[str(chat)] = {
+            "id": resolved.id,
+            "type": peer_type,
+            "access_hash": access_hash,
+            "title": resolved.title or resolved.username,
+            "protected": bool(resolved.has_protected_content),
+            "topics": {},
+            "resolved_at": time.time()
+        }
+        self.save()
+
+    def topic(self, client, chat, topic_id):
+        """Whether a topic of a cached chat exists, None if it wasn't checked yet"""
+        entry = self.get(client, chat)
+        return entry.get("topics", {}).get(str(topic_id)) if entry else None
+
+    def add_topic(self, client, chat, topic_id, valid):
+        entry = self.get(client, chat)
+        if entry:
+            entry.setdefault("topics", {})[str(topic_id)] = valid
+            self.save()
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.peers, f, indent=4)
+
+    async def restore(self, client, entry):
+        """Put a cached peer back into the session storage if it went missing there"""
+        try:
+            await client.storage.get_peer_by_id(entry["id"])
+        except KeyError:
+            await client.storage.update_peers([(entry["id"], entry["access_hash"], entry["type"], None, None)])
+
+peer_cache = PeerCache(PEERS_FILE)
+
+class TransferJournal:
+    """SQLite log of every (source group, destination) sent, used by --resume to skip finished work"""
+
+    FLUSH_EVERY = 200
+    FLUSH_INTERVAL = 5.0
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            # The primary key is the lookup index, so checks stay cheap at millions of rows
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS transfers ("
+                "source INTEGER NOT NULL, group_key INTEGER NOT NULL, destination INTEGER NOT NULL, "
+                "dest_topic INTEGER NOT NULL, media_group_id TEXT, status TEXT NOT NULL, "
+                "dest_ids TEXT, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (source, group_key, destination, dest_topic)) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ranges ("
+                "source INTEGER PRIMARY KEY, start_id INTEGER NOT NULL, end_id INTEGER NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS follow ("
+                "source INTEGER NOT NULL, topic INTEGER NOT NULL, last_id INTEGER NOT NULL, "
+                "PRIMARY KEY (source, topic))"
+            )
+            self._db.commit()
+        return self._db
+
+    def record(self, messages, dest_chat_id, dest_topic, status, sent=None):
+        """Queue the outcome of sending a group to a destination, written in batches"""
+        first_msg = messages[0]
+        if sent is not None and not isinstance(sent, list):
+            sent = [sent]
+        dest_ids = ",".join(str(m.id) for m in sent) if sent else None
+        key = (first_msg.chat.id, first_msg.id, dest_chat_id, dest_topic or 0)
+        metrics.count("groups_total", source=first_msg.chat.id, destination=dest_chat_id, status=status)
+        self._pending[key] = (first_msg.media_group_id, status, dest_ids, time.time())
+        if len(self._pending) >= self.FLUSH_EVERY or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        rows = [key + value for key, value in self._pending.items()]
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO transfers VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._pending.clear()
+
+    def is_done(self, messages, dest_chat_id, dest_topic):
+        first_msg = messages[0]
+        key = (first_msg.chat.id, first_msg.id, dest_chat_id, dest_topic or 0)
+        if key in self._pending:
+            return self._pending[key][1] == "done"
+        row = self.db.execute(
+            "SELECT status FROM transfers WHERE source=? AND group_key=? AND destination=? AND dest_topic=?", key
+        ).fetchone()
+        return row is not None and row[0] == "done"
+
+    def save_range(self, source, start_id, end_id):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO ranges VALUES (?, ?, ?)", (source, start_id, end_id))
+
+    def last_range(self, source):
+        row = self.db.execute("SELECT start_id, end_id FROM ranges WHERE source=?", (source,)).fetchone()
+        return tuple(row) if row else None
+
+    def save_last_seen(self, source, topic, last_id):
+        """Follow mode: the newest message id of a source that went through process_group"""
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO follow VALUES (?, ?, ?)", (source, topic or 0, last_id))
+
+    def last_seen(self, source, topic):
+        row = self.db.execute("SELECT last_id FROM follow WHERE source=? AND topic=?", (source, topic or 0)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+journal = TransferJournal(JOURNAL_FILE)
+
+def media_ext(message):
+    return ".jpg" if message.photo else ".mp4"
+
+def link_or_copy(src, dst):
+    """Hard link src to dst (no extra bytes on disk), copy when linking is not possible"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class MediaCache:
+    """Content-addressed store keyed by file_unique_id: downloaded files (LRU, capped at MEDIA_CACHE_MB),
+    the file_ids each account already uploaded and the destinations each media was sent to"""
+
+    def __init__(self, path, directory, limit):
+        self.path = path
+        self.directory = directory
+        self.limit = limit
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.upload_hits = 0
+        self.duplicates = 0
+        self._db = None
+        self._pins = {}
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "unique_id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                "unique_id TEXT NOT NULL, account TEXT NOT NULL, file_id TEXT NOT NULL, "
+                "PRIMARY KEY (unique_id, account)) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sent ("
+                "unique_id TEXT NOT NULL, destination INTEGER NOT NULL, dest_topic INTEGER NOT NULL, "
+                "PRIMARY KEY (unique_id, destination, dest_topic)) WITHOUT ROWID"
+            )
+            self._db.commit()
+            self.total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        return self._db
+
+    def pin(self, unique_id):
+        self._pins[unique_id] = self._pins.get(unique_id, 0) + 1
+
+    def unpin(self, unique_id):
+        if unique_id in self._pins:
+            self._pins[unique_id] -= 1
+            if not self._pins[unique_id]:
+                del self._pins[unique_id]
+
+    def release(self, message):
+        """Unpin the media of a message once its file is no longer needed"""
+        media = message.photo or message.video
+        if media:
+            self.unpin(media.file_unique_id)
+
+    def cache_path(self, message):
+        media = message.photo or message.video
+        return os.path.join(self.directory, f"{media.file_unique_id}{media_ext(message)}")
+
+    def get_file(self, message):
+        """Path of the cached file for this message's media (pinned until unpin), None on a miss"""
+        if not MEDIA_CACHE:
+            return None
+        unique_id = (message.photo or message.video).file_unique_id
+        row = self.db.execute("SELECT path, size FROM files WHERE unique_id=?", (unique_id,)).fetchone()
+        if row and os.path.exists(row[0]):
+            self.db.execute("UPDATE files SET last_used=? WHERE unique_id=?", (time.time(), unique_id))
+            self.hits += 1
+            self.pin(unique_id)
+            return row[0]
+        if row:
+            self.db.execute("DELETE FROM files WHERE unique_id=?", (unique_id,))
+            self.total -= row[1]
+        self.misses += 1
+        return None
+
+    def add_file(self, message, file_path):
+        """Store a downloaded file (pinned until unpin), hard linking it into the cache if it lives elsewhere"""
+        if not MEDIA_CACHE or not os.path.exists(file_path):
+            return
+        unique_id = (message.photo or message.video).file_unique_id
+        path = self.cache_path(message)
+        if os.path.abspath(file_path) != os.path.abspath(path):
+            link_or_copy(file_path, path)
+        size = os.path.getsize(path)
+        row = self.db.execute("SELECT size FROM files WHERE unique_id=?", (unique_id,)).fetchone()
+        if row:
+            self.total -= row[0]
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (unique_id, path, size, time.time()))
+        self.total += size
+        self.pin(unique_id)
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used files until the cache fits in its size cap, files in use are kept"""
+        if self.total <= self.limit:
+            return
+        for unique_id, path, size in self.db.execute("SELECT unique_id, path, size FROM files ORDER BY last_used").fetchall():
+            if self.total <= self.limit:
+                break
+            if unique_id in self._pins:
+                continue
+            if os.path.exists(path):
+                os.remove(path)
+            self.db.execute("DELETE FROM files WHERE unique_id=?", (unique_id,))
+            self.total -= size
+
+    def get_upload(self, client, message):
+        if not MEDIA_CACHE:
+            return None
+        row = self.db.execute(
+            "SELECT file_id FROM uploads WHERE unique_id=? AND account=?",
+            ((message.photo or message.video).file_unique_id, client.name)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_upload(self, client, message, file_id):
+        if MEDIA_CACHE:
+            self.db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)",
+                ((message.photo or message.video).file_unique_id, client.name, file_id)
+            )
+
+    def drop_uploads(self, client, messages):
+        if MEDIA_CACHE:
+            self.db.executemany(
+                "DELETE FROM uploads WHERE unique_id=? AND account=?",
+                [((m.photo or m.video).file_unique_id, client.name) for m in messages if m.photo or m.video]
+            )
+
+    def was_sent(self, messages, dest_chat_id, dest_topic):
+        """True if every photo/video of the group already went to this destination"""
+        unique_ids = [(m.photo or m.video).file_unique_id for m in messages if m.photo or m.video]
+        if not SKIP_DUPLICATES or not unique_ids:
+            return False
+        for unique_id in unique_ids:
+            row = self.db.execute(
+                "SELECT 1 FROM sent WHERE unique_id=? AND destination=? AND dest_topic=?",
+                (unique_id, dest_chat_id, dest_topic or 0)
+            ).fetchone()
+            if row is None:
+                return False
+        return True
+
+    def mark_sent(self, messages, dest_chat_id, dest_topic):
+        if SKIP_DUPLICATES:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO sent VALUES (?, ?, ?)",
+                [((m.photo or m.video).file_unique_id, dest_chat_id, dest_topic or 0) for m in messages if m.photo or m.video]
+            )
+
+    def flush(self):
+        if self._db is not None:
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "upload_hits": self.upload_hits,
+            "duplicates": self.duplicates,
+            "size_mb": round(self.total / 1024 / 1024, 1),
+        }
+
+    def print_stats(self):
+        if MEDIA_CACHE or SKIP_DUPLICATES:
+            stats = self.stats()
+            print(Fore.CYAN + f"Media cache → {stats['hits']} hits, {stats['misses']} misses, "
+                  f"{stats['upload_hits']} re-used uploads, {stats['duplicates']} duplicates skipped, "
+                  f"{stats['size_mb']} MB cached" + Style.RESET_ALL)
+
+media_cache = MediaCache(MEDIA_CACHE_FILE, MEDIA_CACHE_DIR, MEDIA_CACHE_MB * 1024 * 1024)
+
+class Metrics:
+    """Counters and latency histograms per stage, labelled by source, destination and account.
+    Exported as Prometheus text (or JSON for a .json METRICS_FILE) and served on METRICS_PORT"""
+
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+        self._server = None
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            # [bucket counts, sum, count]
+            hist = self.histograms[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+        hist[0][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        hist[1] += seconds
+        hist[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    async def sleep(self, seconds, reason, **labels):
+        self.count("sleep_seconds_total", seconds, reason=reason, **labels)
+        await asyncio.sleep(seconds)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [f'{k}="{v}"' for k, v in labels + tuple(extra)]
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def prometheus(self):
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items(), key=lambda item: item[0][0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE tgtransfer_{name} counter")
+            lines.append(f"tgtransfer_{name}{self._labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items(), key=lambda item: item[0][0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE tgtransfer_{name} gauge")
+            lines.append(f"tgtransfer_{name}{self._labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in sorted(self.histograms.items(), key=lambda item: item[0][0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE tgtransfer_{name} histogram")
+            cumulative = 0
+            for bound, hits in zip(self.BUCKETS + ("+Inf",), buckets):
+                cumulative += hits
+                lines.append(f"tgtransfer_{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"tgtransfer_{name}_sum{self._labels(labels)} {total}")
+            lines.append(f"tgtransfer_{name}_count{self._labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def json(self):
+        return json.dumps({
+            "uptime_seconds": round(time.monotonic() - self.started, 3),
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in self.counters.items()],
+            "gauges": [{"name": name, "labels": dict(labels), "value": value}
+                       for (name, labels), value in self.gauges.items()],
+            "histograms": [{"name": name, "labels": dict(labels), "sum": total, "count": count,
+                            "buckets": dict(zip(map(str, self.BUCKETS + ("+Inf",)), buckets))}
+                           for (name, labels), (buckets, total, count) in self.histograms.items()],
+        }, indent=2)
+
+    def export(self):
+        """Write METRICS_FILE, called after every batch and at the end of the run"""
+        if not METRICS_FILE:
+            return
+        os.makedirs(os.path.dirname(METRICS_FILE) or ".", exist_ok=True)
+        temp_path = f"{METRICS_FILE}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.json() if METRICS_FILE.endswith(".json") else self.prometheus())
+        os.replace(temp_path, METRICS_FILE)
+
+    async def serve(self):
+        """METRICS_PORT: answer every HTTP request with the current metrics (JSON for paths ending in .json)"""
+        if not METRICS_PORT or self._server:
+            return
+
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                while (await reader.readline()).strip():
+                    pass
+                path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+                if path.endswith(".json"):
+                    body, content_type = self.json(), "application/json"
+                else:
+                    body, content_type = self.prometheus(), "text/plain; version=0.0.4"
+                body = body.encode()
+                writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                             f"Connection: close\r\n\r\n".encode() + body)
+                await writer.drain()
+            finally:
+                writer.close()
+
+        self._server = await asyncio.start_server(handle, "127.0.0.1", METRICS_PORT)
+        print(Fore.CYAN + f"Metrics served on http://127.0.0.1:{METRICS_PORT}/metrics" + Style.RESET_ALL)
+
+    def close(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    def summary(self):
+        """Totals per stage over all labels: {stage: (calls, total seconds, approx. p95 seconds)} and byte rates"""
+        stages = {}
+        for (name, _), (buckets, total, count) in self.histograms.items():
+            stage = stages.setdefault(name, [[0] * len(buckets), 0.0, 0])
+            stage[0] = [a + b for a, b in zip(stage[0], buckets)]
+            stage[1] += total
+            stage[2] += count
+        result = {}
+        for name, (buckets, total, count) in stages.items():
+            p95, seen = self.BUCKETS[-1], 0
+            for bound, hits in zip(self.BUCKETS, buckets):
+                seen += hits
+                if seen >= 0.95 * count:
+                    p95 = bound
+                    break
+            result[name] = (count, total, p95)
+        totals = {}
+        for (name, _), value in self.counters.items():
+            totals[name] = totals.get(name, 0) + value
+        return result, totals
+
+    def print_summary(self):
+        stages, totals = self.summary()
+        if not stages and not totals:
+            return
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        print(Fore.CYAN + Style.BRIGHT + "\nRun summary" + Style.RESET_ALL)
+        for name, (count, total, p95) in sorted(stages.items()):
+            print(Fore.CYAN + f"  {name}: {count} calls, {total:.1f}s total, avg {total / count:.2f}s, p95 ≤ {p95}s" + Style.RESET_ALL)
+        for name in ("download_bytes_total", "upload_bytes_total"):
+            if name in totals:
+                mb = totals[name] / 1024 / 1024
+                print(Fore.CYAN + f"  {name}: {mb:.1f} MB ({mb / elapsed:.2f} MB/s over the run)" + Style.RESET_ALL)
+        for name in ("floodwaits_total", "floodwait_seconds_total", "rate_limit_wait_seconds_total", "sleep_seconds_total"):
+            if name in totals:
+                print(Fore.CYAN + f"  {name}: {round(totals[name], 1)}" + Style.RESET_ALL)
+
+metrics = Metrics()
+
+class TokenBucket:
+    """Token bucket whose rate adapts to FloodWaits: cut in half on a FloodWait, raised a little after each success"""
+
+    MIN_RATE = 0.02
+    INCREASE = 0.02
+    DECREASE = 0.5
+
+    def __init__(self, rate, max_rate):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.flood_waits = 0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.INCREASE)
+
+    def on_flood(self, seconds):
+        self.flood_waits += 1
+        self.rate = max(self.MIN_RATE, self.rate * self.DECREASE)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class RateLimiter:
+    """Paces sends with one adaptive token bucket per account and one per destination chat"""
+
+    def __init__(self):
+        self.buckets = {}
+        self._slots = None
+
+    def _bucket(self, kind, key):
+        if (kind, key) not in self.buckets:
+            if kind == "account":
+                self.buckets[(kind, key)] = TokenBucket(ACCOUNT_RATE, max(ACCOUNT_RATE, SEND_RATE_MAX))
+            else:
+                self.buckets[(kind, key)] = TokenBucket(SEND_RATE, SEND_RATE_MAX)
+        return self.buckets[(kind, key)]
+
+    def slots(self):
+        """Global cap on sends in flight across all groups, destinations and sources"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(1, SEND_CONCURRENCY))
+        return self._slots
+
+    async def acquire(self, client, dest_chat_id):
+        start = time.perf_counter()
+        await self._bucket("dest", (client.name, dest_chat_id)).acquire()
+        await self._bucket("account", client.name).acquire()
+        metrics.count("rate_limit_wait_seconds_total", time.perf_counter() - start, account=client.name, destination=dest_chat_id)
+
+    def on_success(self, client, dest_chat_id):
+        self._bucket("dest", (client.name, dest_chat_id)).on_success()
+        self._bucket("account", client.name).on_success()
+
+    def on_flood(self, client, dest_chat_id, seconds):
+        metrics.count("floodwaits_total", account=client.name, destination=dest_chat_id)
+        metrics.count("floodwait_seconds_total", seconds, account=client.name, destination=dest_chat_id)
+        # FloodWaits are account wide, slow down both the account and the destination that hit it
+        self._bucket("dest", (client.name, dest_chat_id)).on_flood(seconds)
+        self._bucket("account", client.name).on_flood(seconds)
+
+    def blocked_for(self, client):
+        """Seconds left before this account may send again"""
+        return max(0.0, self._bucket("account", client.name).blocked_until - time.monotonic())
+
+    def report(self):
+        """Current rate (sends/s) and FloodWait count of every bucket"""
+        report = {}
+        for (kind, key), bucket in self.buckets.items():
+            name = f"account {key}" if kind == "account" else f"dest {key[1]} ({key[0]})"
+            report[name] = (round(bucket.rate, 3), bucket.flood_waits)
+        return report
+
+    def print_report(self):
+        rates = ", ".join(f"{name}: {rate}/s ({floods} FloodWaits)" for name, (rate, floods) in self.report().items())
+        if rates:
+            print(Fore.CYAN + f"Send rates → {rates}" + Style.RESET_ALL)
+
+limiter = RateLimiter()
+
 async def create_session():
     session_name = input(Fore.GREEN + Style.BRIGHT + "Enter a name for the new session (e.g., account1): " + Style.RESET_ALL).strip()
     if not session_name:
@@ -91,7 +758,7 @@ async def create_session():
         print(Fore.RED + f"Session '{session_name}' already exists." + Style.RESET_ALL)
         return
     
-    client = Client(name=session_name, api_id=API_ID, api_hash=API_HASH, workdir="sessions")
+    client = Client(name=session_name, api_id=API_ID, api_hash=API_HASH, workdir="sessions", max_concurrent_transmissions=max(1, DOWNLOAD_CONNECTIONS))
     await client.connect()
     
     try:
@@ -146,18 +813,84 @@ async def list_sessions():
     print(Fore.RED + "Invalid choice." + Style.RESET_ALL)
     return None
 
+async def retry_floodwait(func, *args, **kwargs):
+    """Calls outside the send path: clients run with sleep_threshold=0, so FloodWaits are waited out here"""
+    while True:
+        try:
+            return await func(*args, **kwargs)
+        except FloodWait as e:
+            print(Fore.YELLOW + f"FloodWait: sleeping {e.value} seconds..." + Style.RESET_ALL)
+            await metrics.sleep(e.value + 1, "floodwait")
+
+async def load_dialogs(client):
+    """Scan the dialogs once per session so unknown peers land in its storage, returns False if already done"""
+    if client.name in DIALOGS_LOADED:
+        return False
+    DIALOGS_LOADED.add(client.name)
+    print(Fore.YELLOW + Style.BRIGHT + "Loading dialogs to cache chats/channels..." + Style.RESET_ALL)
+    while True:
+        try:
+            async for _ in client.get_dialogs():
+                pass
+            break
+        except FloodWait as e:
+            await metrics.sleep(e.value + 1, "floodwait", account=client.name)
+    print(Fore.GREEN + Style.BRIGHT + "Dialogs loaded." + Style.RESET_ALL)
+    return True
+
+async def check_topic(client, chat, chat_id, topic_id):
+    """True if topic_id is a forum topic of the chat, the answer is cached with the chat in peers.json"""
+    valid = peer_cache.topic(client, chat, topic_id)
+    if valid is not None:
+        return valid
+    peer = await client.resolve_peer(chat_id)
+    valid = False
+    if isinstance(peer, raw.types.InputPeerChannel):
+        try:
+            r = await retry_floodwait(client.invoke, raw.functions.channels.GetForumTopicsByID(
+                channel=raw.types.InputChannel(channel_id=peer.channel_id, access_hash=peer.access_hash),
+                topics=[topic_id]
+            ))
+            valid = any(isinstance(t, raw.types.ForumTopic) for t in r.topics)
+        except BadRequest:
+            # CHANNEL_FORUM_MISSING: not a forum at all
+            pass
+    peer_cache.add_topic(client, chat, topic_id, valid)
+    return valid
+
 async def resolve_chat(client, chat_spec):
     chat, topic_id = chat_spec
+    cached = peer_cache.get(client, chat)
     try:
+        if cached:
+            await peer_cache.restore(client, cached)
+            if cached["protected"]:
+                RESTRICTED_CHATS.add(cached["id"])
+            print(Fore.CYAN + Style.BRIGHT + f"Chat {chat} resolved from cache → ID: {cached['id']} (Title: {cached['title']})" + Style.RESET_ALL)
+            if topic_id and not await check_topic(client, chat, cached["id"], topic_id):
+                print(Fore.RED + f"Topic {topic_id} does not exist in {chat}" + Style.RESET_ALL)
+                return None, None, None
+            return cached["id"], topic_id, cached["title"]
+        chat_ref = chat if str(chat).startswith("@") else int(chat)
+        try:
+            resolved = await retry_floodwait(client.get_chat, chat_ref)
+        except (PeerIdInvalid, ChannelInvalid, KeyError):
+            # Peer not in the session storage yet, the dialog scan is only paid for here
+            if not await load_dialogs(client):
+                raise
+            resolved = await retry_floodwait(client.get_chat, chat_ref)
+        if resolved.has_protected_content:
+            RESTRICTED_CHATS.add(resolved.id)
+        await peer_cache.add(client, chat, resolved)
         if str(chat).startswith("@"):
-            resolved = await client.get_chat(chat)
             print(Fore.CYAN + Style.BRIGHT + f"Resolved @{chat} → ID: {resolved.id} (Title: {resolved.title or resolved.username})" + Style.RESET_ALL)
-            return resolved.id, topic_id, resolved.title or resolved.username
         else:
-            chat_id = int(chat)
-            resolved = await client.get_chat(chat_id)
             print(Fore.CYAN + Style.BRIGHT + f"Chat ID {chat} resolved → Title: {resolved.title or resolved.username}" + Style.RESET_ALL)
-            return chat_id, topic_id, resolved.title or resolved.username
+        # A wrong chat:topic fails here instead of at the first send
+        if topic_id and not await check_topic(client, chat, resolved.id, topic_id):
+            print(Fore.RED + f"Topic {topic_id} does not exist in {chat}" + Style.RESET_ALL)
+            return None, None, None
+        return resolved.id, topic_id, resolved.title or resolved.username
     except ChannelPrivate:
         print(Fore.RED + f"You are not a member or banned from this channel/group: {chat}" + Style.RESET_ALL)
     except ChannelInvalid:
@@ -166,38 +899,990 @@ async def resolve_chat(client, chat_spec):
         print(Fore.RED + f"Error resolving {chat}: {e}" + Style.RESET_ALL)
     return None, None, None
 
-async def process_group(client, messages, dest_chats, src_title, src_topic):
-    if not messages:
-        return
-    
-    first_msg = messages[0]
-    
-    # Check if we should process this group based on media type filters
+def local_save_dir(src_title):
+    safe_title = src_title.replace(" ", "_").replace("/", "_").replace("|", "_").replace("\\", "_").replace(":", "_")
+    save_dir = os.path.join("downloads", safe_title)
+    os.makedirs(save_dir, exist_ok=True)
+    return save_dir
+
+class LocalArchive:
+    """SAVE_TO_LOCAL bookkeeping. With ARCHIVE_INDEX every source folder gets a manifest.db
+    (message id, media_group_id, file_unique_id, size, sha256, caption) and files are sharded
+    into sub-folders of ARCHIVE_SHARD_SIZE message ids, so re-syncs and lookups never list directories"""
+
+    def __init__(self):
+        self._dbs = {}
+
+    def _db(self, save_dir):
+        if save_dir not in self._dbs:
+            db = sqlite3.connect(os.path.join(save_dir, "manifest.db"))
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS manifest ("
+                "message_id INTEGER PRIMARY KEY, media_group_id TEXT, file_unique_id TEXT, "
+                "size INTEGER NOT NULL, sha256 TEXT, caption TEXT, path TEXT NOT NULL, saved_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._dbs[save_dir] = db
+        return self._dbs[save_dir]
+
+    def path(self, src_title, message):
+        save_dir = local_save_dir(src_title)
+        if ARCHIVE_INDEX:
+            shard = message.id // ARCHIVE_SHARD_SIZE * ARCHIVE_SHARD_SIZE
+            save_dir = os.path.join(save_dir, f"{shard:09d}")
+            os.makedirs(save_dir, exist_ok=True)
+        return os.path.join(save_dir, f"{message.id}{media_ext(message)}")
+
+    def find(self, src_title, message):
+        """Path of the complete archived copy of this media (judged by message id and size), None if it still has to be saved"""
+        size = (message.photo or message.video).file_size
+        if ARCHIVE_INDEX:
+            row = self._db(local_save_dir(src_title)).execute(
+                "SELECT size, path FROM manifest WHERE message_id=?", (message.id,)
+            ).fetchone()
+            if row is None or (size and row[0] != size):
+                return None
+            file_path = row[1]
+        else:
+            file_path = self.path(src_title, message)
+        if not os.path.exists(file_path) or (size and os.path.getsize(file_path) != size):
+            return None
+        return file_path
+
+    @staticmethod
+    def sha256(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    async def add(self, src_title, message, file_path):
+        """Index a file that was just written to the archive"""
+        if not ARCHIVE_INDEX:
+            return
+        media = message.photo or message.video
+        # Hashing a large video would stall the event loop
+        sha256 = await asyncio.get_running_loop().run_in_executor(None, self.sha256, file_path)
+        db = self._db(local_save_dir(src_title))
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (message.id, message.media_group_id, media.file_unique_id, os.path.getsize(file_path),
+                 sha256, message.caption or None, file_path, time.time())
+            )
+
+    def close(self):
+        for db in self._dbs.values():
+            db.close()
+        self._dbs.clear()
+
+local_archive = LocalArchive()
+
+def should_process_group(messages):
+    """Check if a group passes the PHOTOS/VIDEOS/TEXT filters"""
     has_photo = any(m.photo for m in messages)
     has_video = any(m.video for m in messages)
     has_text = any(m.text or m.caption for m in messages)
+    return (PHOTOS and has_photo) or (VIDEOS and has_video) or (TEXT and has_text)
+
+def group_size(messages):
+    """Total bytes of the photos/videos in a group, from message metadata"""
+    total = 0
+    for m in messages:
+        media = m.photo or m.video
+        if media:
+            total += media.file_size or 0
+    return total
+
+def pending_destinations(messages, dest_chats):
+    """Destinations this group still has to be sent to (all of them unless --resume)"""
+    if not RESUME:
+        return dest_chats
+    return [(dest_chat_id, dest_topic) for dest_chat_id, dest_topic in dest_chats
+            if not journal.is_done(messages, dest_chat_id, dest_topic)]
+
+def skip_duplicate(messages, dest_chat_id, dest_topic):
+    """SKIP_DUPLICATES: True (and logged in the journal) if every media of the group already went to this destination"""
+    if not media_cache.was_sent(messages, dest_chat_id, dest_topic):
+        return False
+    media_cache.duplicates += 1
+    journal.record(messages, dest_chat_id, dest_topic, "duplicate")
+    return True
+
+def stale_file_id(e):
+    """True if a send by file_id was refused because the file reference in it is outdated"""
+    return any(error in str(e) for error in ("FILE_REFERENCE_", "MEDIA_EMPTY", "FILE_ID_INVALID"))
+
+def needs_download(client, messages, dest_chats):
+    """True if this group will surely go through Strategy 2 (download & upload)"""
+    if FORWARDING_ONLY or STREAM_UPLOAD or not should_process_group(messages):
+        return False
+    media_messages = [m for m in messages if m.photo or m.video]
+    if not media_messages:
+        return False
+    # Media this account uploaded before is re-sent by file_id, nothing to download
+    if all(media_cache.get_upload(client, m) for m in media_messages):
+        return False
+    dest_chats = pending_destinations(messages, dest_chats)
+    if all(media_cache.was_sent(messages, dest_chat_id, dest_topic) for dest_chat_id, dest_topic in dest_chats):
+        return False
+    return not FORWARDING or messages[0].chat.id in RESTRICTED_CHATS
+
+async def download_group(messages, src_title):
+    """Download the photos/videos of a group, returns a list of (message, file_path, is_temp)"""
+    files = []
+    try:
+        for message in messages:
+            if message.photo or message.video:
+                ext = media_ext(message)
+                cached = media_cache.get_file(message)
+                archived = None
+                
+                if SAVE_TO_LOCAL:
+                    archived = local_archive.find(src_title, message)
+                    file_path = archived or local_archive.path(src_title, message)
+                    if cached and not archived:
+                        link_or_copy(cached, file_path)
+                        await local_archive.add(src_title, message, file_path)
+                elif MEDIA_CACHE:
+                    # The cache owns the file, it is reused by later copies of the same media
+                    file_path = cached or media_cache.cache_path(message)
+                else:
+                    file_path = os.path.join("downloads", f"temp_{'p' if message.photo else 'v'}_{message.chat.id}_{message.id}{ext}")
+                
+                if not cached and not archived:
+                    await download_media(message, file_path)
+                    media_cache.add_file(message, file_path)
+                    if SAVE_TO_LOCAL:
+                        await local_archive.add(src_title, message, file_path)
+                files.append((message, file_path, not SAVE_TO_LOCAL and not MEDIA_CACHE))
+    except BaseException:
+        cleanup_files(files)
+        raise
+    return files
+
+async def download_media(message, file_path):
+    """Download a photo/video to file_path, large files are split over DOWNLOAD_CONNECTIONS connections
+    and resume where an interrupted run left off"""
+    media = message.photo or message.video
+    file_size = media.file_size or 0
+    client = message._client
+    with metrics.timer("download_seconds", source=message.chat.id, account=client.name):
+        if file_size < PARALLEL_DOWNLOAD_MIN_MB * 1024 * 1024:
+            path = await message.download(file_path, progress=download_bandwidth.progress())
+        else:
+            path = await parallel_download(client, message, file_path, file_size)
+    metrics.count("download_bytes_total", file_size, source=message.chat.id, account=client.name)
+    return path
+
+def load_download_progress(progress_path, temp_path, file_size):
+    """Chunks already written by an interrupted parallel_download: {first_chunk: [chunk_count, done]}"""
+    if not (os.path.exists(progress_path) and os.path.exists(temp_path)):
+        return None
+    try:
+        with open(progress_path, "r") as f:
+            progress = json.load(f)
+    except ValueError:
+        return None
+    if progress.get("size") != file_size or os.path.getsize(temp_path) != file_size:
+        return None
+    return {int(first_chunk): part for first_chunk, part in progress["parts"].items()}
+
+def save_download_progress(progress_path, file_size, parts):
+    with open(progress_path, "w") as f:
+        json.dump({"size": file_size, "parts": parts}, f)
+
+async def parallel_download(client, message, file_path, file_size):
+    """Fetch contiguous 1 MiB chunk ranges concurrently into a preallocated file.
+    Each part resumes from its last written chunk when its connection fails, and a .temp.json
+    progress file lets the next run pick up an interrupted download instead of starting over."""
+    chunk_size = 1024 * 1024
+    total_chunks = math.ceil(file_size / chunk_size)
+    temp_path = f"{file_path}.temp"
+    progress_path = f"{temp_path}.json"
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    parts = load_download_progress(progress_path, temp_path, file_size)
+    if parts is None:
+        per_part = math.ceil(total_chunks / max(1, DOWNLOAD_CONNECTIONS))
+        parts = {start: [min(per_part, total_chunks - start), 0] for start in range(0, total_chunks, per_part)}
+        with open(temp_path, "wb") as f:
+            f.truncate(file_size)
     
-    should_process = (PHOTOS and has_photo) or (VIDEOS and has_video) or (TEXT and has_text)
+    async def fetch_part(first_chunk, part):
+        chunk_count = part[0]
+        failures = 0
+        # Unbuffered, so every chunk counted in the progress file is already with the OS
+        with open(temp_path, "r+b", buffering=0) as f:
+            while part[1] < chunk_count:
+                try:
+                    async for chunk in client.stream_media(message, offset=first_chunk + part[1], limit=chunk_count - part[1]):
+                        await download_bandwidth.consume(len(chunk))
+                        f.seek((first_chunk + part[1]) * chunk_size)
+                        f.write(chunk)
+                        part[1] += 1
+                        if part[1] % 8 == 0:
+                            save_download_progress(progress_path, file_size, parts)
+                    if part[1] < chunk_count:
+                        raise RuntimeError(f"Stream ended at chunk {first_chunk + part[1]}")
+                except FloodWait as e:
+                    await metrics.sleep(e.value + 1, "floodwait", account=client.name)
+                except Exception:
+                    failures += 1
+                    if failures >= MAX_RETRIES:
+                        raise
+                    await metrics.sleep(failures, "retry", account=client.name)
     
-    if not should_process:
-        return
+    tasks = [asyncio.create_task(fetch_part(first_chunk, part)) for first_chunk, part in parts.items()]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Keep the partial file, the next attempt continues from the saved progress
+        save_download_progress(progress_path, file_size, parts)
+        raise
+    os.replace(temp_path, file_path)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    return file_path
+
+async def save_file_part(client, upload_file_id, part, total_parts, data, is_big):
+    await upload_bandwidth.consume(len(data))
+    if is_big:
+        rpc = raw.functions.upload.SaveBigFilePart(file_id=upload_file_id, file_part=part, file_total_parts=total_parts, bytes=data)
+    else:
+        rpc = raw.functions.upload.SaveFilePart(file_id=upload_file_id, file_part=part, bytes=data)
+    while True:
+        try:
+            if not await client.invoke(rpc):
+                raise RuntimeError(f"Upload of part {part} was refused")
+            return
+        except FloodWait as e:
+            await metrics.sleep(e.value + 1, "floodwait", account=client.name)
+
+async def stream_upload(client, message, tee_path=None):
+    """Pipe a message's media from stream_media straight into upload parts, holding at most
+    STREAM_BUFFER_MB of 1 MiB chunks in memory. With tee_path the same bytes are also written
+    to that file. Returns the raw InputFile/InputFileBig of the upload."""
+    media = message.photo or message.video
+    part_size = 512 * 1024
+    # Parts go up over 4 concurrent requests like pyrogram's save_file, at most 8 parts (4 MiB) in flight
+    upload_workers = 4
+    file_size = media.file_size or 0
+    is_big = file_size > 10 * 1024 * 1024
+    total_parts = max(1, math.ceil(file_size / part_size))
+    upload_file_id = client.rnd_id()
+    md5_sum = None if is_big else hashlib.md5()
+    queue = asyncio.Queue(maxsize=max(1, STREAM_BUFFER_MB))
+    parts = asyncio.Queue(maxsize=upload_workers)
+    upload_errors = []
+    
+    async def reader():
+        try:
+            async for chunk in client.stream_media(message):
+                await download_bandwidth.consume(len(chunk))
+                await queue.put(chunk)
+        except Exception as e:
+            # Passed on in place of the end marker, the upload would otherwise wait for it forever
+            await queue.put(e)
+            return
+        await queue.put(None)
+    
+    async def uploader():
+        while True:
+            item = await parts.get()
+            if item is None:
+                return
+            # After a failure the remaining parts are only drained, so put_part never blocks
+            if upload_errors:
+                continue
+            try:
+                await save_file_part(client, upload_file_id, item[0], total_parts, item[1], is_big)
+            except Exception as e:
+                upload_errors.append(e)
+    
+    async def put_part(data):
+        nonlocal part
+        if upload_errors:
+            raise upload_errors[0]
+        await parts.put((part, data))
+        part += 1
+    
+    reader_task = asyncio.create_task(reader())
+    uploader_tasks = [asyncio.create_task(uploader()) for _ in range(upload_workers)]
+    tee = open(tee_path + ".part", "wb") if tee_path else None
+    part = 0
+    streamed = 0
+    pending = b""
+    start = time.perf_counter()
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            streamed += len(chunk)
+            if tee:
+                tee.write(chunk)
+            if md5_sum:
+                md5_sum.update(chunk)
+            pending += chunk
+            while len(pending) >= part_size:
+                await put_part(pending[:part_size])
+                pending = pending[part_size:]
+        if pending:
+            await put_part(pending)
+        for _ in uploader_tasks:
+            await parts.put(None)
+        await asyncio.gather(*uploader_tasks)
+        if upload_errors:
+            raise upload_errors[0]
+        await reader_task
+        # stream_media ends quietly when a chunk request fails, a short upload must not be sent or archived
+        if streamed != file_size:
+            raise RuntimeError(f"Streamed {streamed} bytes of {message.id}, expected {file_size}")
+    except BaseException:
+        if tee:
+            tee.close()
+            os.remove(tee_path + ".part")
+            tee = None
+        raise
+    finally:
+        if not reader_task.done():
+            reader_task.cancel()
+        for task in uploader_tasks:
+            task.cancel()
+        if tee:
+            tee.close()
+            os.replace(tee_path + ".part", tee_path)
+    
+    metrics.observe("stream_upload_seconds", time.perf_counter() - start, source=message.chat.id, account=client.name)
+    metrics.count("download_bytes_total", file_size, source=message.chat.id, account=client.name)
+    metrics.count("upload_bytes_total", file_size, account=client.name)
+    file_name = f"{message.id}{media_ext(message)}"
+    if is_big:
+        return raw.types.InputFileBig(id=upload_file_id, parts=part, name=file_name)
+    return raw.types.InputFile(id=upload_file_id, parts=part, name=file_name, md5_checksum=md5_sum.hexdigest())
+
+async def upload_input_media(client, peer, message, input_file):
+    """Turn an uploaded file into the raw InputMedia of a photo or video, like send_media_group does"""
+    if message.photo:
+        uploaded = await client.invoke(raw.functions.messages.UploadMedia(
+            peer=peer, media=raw.types.InputMediaUploadedPhoto(file=input_file)
+        ))
+        return raw.types.InputMediaPhoto(id=raw.types.InputPhoto(
+            id=uploaded.photo.id,
+            access_hash=uploaded.photo.access_hash,
+            file_reference=uploaded.photo.file_reference
+        ))
     
-    for dest_chat_id, dest_topic in dest_chats:
+    video = message.video
+    uploaded = await client.invoke(raw.functions.messages.UploadMedia(
+        peer=peer,
+        media=raw.types.InputMediaUploadedDocument(
+            file=input_file,
+            mime_type=video.mime_type or "video/mp4",
+            attributes=[
+                raw.types.DocumentAttributeVideo(
+                    supports_streaming=video.supports_streaming or None,
+                    duration=video.duration or 0,
+                    w=video.width or 0,
+                    h=video.height or 0
+                ),
+                raw.types.DocumentAttributeFilename(file_name=video.file_name or f"{message.id}.mp4")
+            ]
+        )
+    ))
+    return raw.types.InputMediaDocument(id=raw.types.InputDocument(
+        id=uploaded.document.id,
+        access_hash=uploaded.document.access_hash,
+        file_reference=uploaded.document.file_reference
+    ))
+
+def cleanup_files(files):
+    """Remove the temp files returned by download_group and unpin its cached files"""
+    for message, file_path, is_temp in files or []:
+        media_cache.release(message)
+        if is_temp and os.path.exists(file_path):
+            os.remove(file_path)
+
+class DiskBudget:
+    """Caps the bytes held on disk by prefetched groups, shared by every source and account.
+    Requests are served by ticket: a later (smaller) group may pass waiting ones only while
+    it still leaves room for all of them, so small items flow and huge videos are never starved"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.waiting = {}
+        self._tickets = itertools.count()
+        self._cond = None
+
+    @property
+    def cond(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def ticket(self):
+        """Place in line, taken in the order the groups will be sent"""
+        return next(self._tickets)
+
+    def _admits(self, ticket, size):
+        ahead = sum(need for other, need in self.waiting.items() if other < ticket)
+        if not ahead and self.used == 0:
+            # A group bigger than the whole budget is still let through on its own
+            return True
+        return self.used + ahead + size <= self.limit
+
+    async def acquire(self, size, ticket):
+        size = min(size, self.limit)
+        async with self.cond:
+            self.waiting[ticket] = size
+            self.report_gauges()
+            try:
+                await self.cond.wait_for(lambda: self._admits(ticket, size))
+            finally:
+                del self.waiting[ticket]
+            self.used += size
+            self.cond.notify_all()
+        self.report_gauges()
+        return size
+
+    async def release(self, size):
+        if not size:
+            return
+        async with self.cond:
+            self.used -= size
+            self.cond.notify_all()
+        self.report_gauges()
+
+    def report_gauges(self):
+        metrics.gauge("disk_budget_used_bytes", self.used)
+        metrics.gauge("disk_budget_limit_bytes", self.limit)
+        metrics.gauge("disk_budget_waiting_groups", len(self.waiting))
+
+    def print_report(self):
+        print(Fore.CYAN + f"Disk budget → {self.used / 1024 / 1024:.1f}/{self.limit / 1024 / 1024:.0f} MB in flight, "
+              f"{len(self.waiting)} groups waiting" + Style.RESET_ALL)
+
+disk_budget = DiskBudget(PREFETCH_MAX_MB * 1024 * 1024)
+
+class Bandwidth:
+    """Global byte-rate cap for one direction (download or upload), 0 = unlimited.
+    Every transfer books the next free slot of len/rate seconds and waits for it to start."""
+
+    def __init__(self, direction, mb_per_second):
+        self.direction = direction
+        self.rate = mb_per_second * 1024 * 1024
+        self.next_free = 0.0
+
+    async def consume(self, size):
+        if self.rate <= 0 or size <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self.next_free)
+        self.next_free = start + size / self.rate
+        if start > now:
+            await metrics.sleep(start - now, "bandwidth", direction=self.direction)
+
+    def progress(self):
+        """Progress callback for pyrogram's get_file/save_file that books every chunk as it goes through,
+        so a single large transfer is held to the cap too (None when uncapped)"""
+        if self.rate <= 0:
+            return None
+        done = 0
+        
+        async def progress(current, total):
+            nonlocal done
+            await self.consume(current - done)
+            done = current
+        return progress
+
+    def eta(self, size):
+        """Seconds needed for size bytes at the cap, None when uncapped"""
+        return size / self.rate if self.rate > 0 else None
+
+download_bandwidth = Bandwidth("download", DOWNLOAD_LIMIT_MBPS)
+upload_bandwidth = Bandwidth("upload", UPLOAD_LIMIT_MBPS)
+
+def can_batch_forward(messages):
+    """True if this group can go into a batched forward_messages call"""
+    if not BATCH_FORWARD or not (FORWARDING or FORWARDING_ONLY):
+        return False
+    return messages[0].chat.id not in RESTRICTED_CHATS
+
+def split_batches(groups, limit=100):
+    """Split groups into runs of at most `limit` message ids, never splitting an album"""
+    batches = []
+    batch, batch_ids = [], 0
+    for msgs in groups:
+        if batch and batch_ids + len(msgs) > limit:
+            batches.append(batch)
+            batch, batch_ids = [], 0
+        batch.append(msgs)
+        batch_ids += len(msgs)
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def parse_sent(client, r):
+    """Messages created by a raw send/forward call, in id order"""
+    sent = await utils.parse_messages(
+        client,
+        raw.types.messages.Messages(
+            messages=[u.message for u in r.updates
+                      if isinstance(u, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage))],
+            users=r.users,
+            chats=r.chats
+        ),
+        replies=0
+    )
+    return sorted(sent, key=lambda m: m.id)
+
+async def forward_raw(client, from_chat_id, message_ids, dest_chat_id, dest_topic, drop_author, drop_media_captions=False):
+    """messages.ForwardMessages, pyrogram 2.0.106's forward_messages takes neither drop_author nor a topic"""
+    r = await client.invoke(
+        raw.functions.messages.ForwardMessages(
+            from_peer=await client.resolve_peer(from_chat_id),
+            id=message_ids,
+            random_id=[client.rnd_id() for _ in message_ids],
+            to_peer=await client.resolve_peer(dest_chat_id),
+            drop_author=drop_author or None,
+            drop_media_captions=drop_media_captions or None,
+            top_msg_id=dest_topic or None
+        )
+    )
+    return await parse_sent(client, r)
+
+async def forward_batch(client, batch, dest_chat_id, dest_topic):
+    """Forward a run of groups to one destination in a single call, returns False if it has to be sent group by group"""
+    first_msg = batch[0][0]
+    message_ids = [m.id for msgs in batch for m in msgs]
+    
+    for _ in range(MAX_RETRIES):
+        try:
+            await limiter.acquire(client, dest_chat_id)
+            with metrics.timer("send_seconds", method="forward_batch", destination=dest_chat_id, account=client.name):
+                # Like the group-by-group copies, captions are only dropped when the sender is hidden
+                sent = await forward_raw(client, first_msg.chat.id, message_ids, dest_chat_id, dest_topic,
+                                         HIDE_SENDER, drop_media_captions=HIDE_SENDER and DROP_CAPTION)
+        except FloodWait as e:
+            print(Fore.YELLOW + f"FloodWait on {dest_chat_id}: retrying batch {first_msg.id} in {e.value} seconds..." + Style.RESET_ALL)
+            limiter.on_flood(client, dest_chat_id, e.value + 1)
+            continue
+        except ChatForwardsRestricted:
+            RESTRICTED_CHATS.add(first_msg.chat.id)
+            return False
+        except TypeError:
+            # A wrong call signature is a bug, not a reason to fall back
+            raise
+        except Exception as e:
+            print(Fore.YELLOW + f"Batch forward of {len(message_ids)} messages from {first_msg.id} failed ({e}), sending group by group." + Style.RESET_ALL)
+            return False
+        
+        limiter.on_success(client, dest_chat_id)
+        # Deleted source messages are silently left out, only map ids back when nothing is missing
+        position = 0
+        for msgs in batch:
+            group_sent = sent[position:position + len(msgs)] if len(sent) == len(message_ids) else None
+            journal.record(msgs, dest_chat_id, dest_topic, "done", group_sent)
+            media_cache.mark_sent(msgs, dest_chat_id, dest_topic)
+            position += len(msgs)
+        return True
+    return False
+
+async def forward_in_batches(client, groups, dest_chats, src_title, src_topic, pbar):
+    """Forward consecutive groups with up to 100 message ids per call and destination"""
+    batches = split_batches(groups)
+    for index, batch in enumerate(batches):
+        src_id = batch[0][0].chat.id
+        if src_id in RESTRICTED_CHATS:
+            # Forwarding got blocked mid-run, everything left goes through download & upload
+            rest = [msgs for remaining in batches[index:] for msgs in remaining]
+            await prefetch_groups(client, rest, dest_chats, src_title, src_topic, pbar)
+            return
+        
+        forwarded = set()
+        fallback = set()
+        restricted_dests = []
+        
+        async def forward_to(dest_chat_id, dest_topic):
+            if src_id in RESTRICTED_CHATS:
+                restricted_dests.append((dest_chat_id, dest_topic))
+                return
+            todo = [msgs for msgs in batch
+                    if should_process_group(msgs) and pending_destinations(msgs, [(dest_chat_id, dest_topic)])
+                    and not skip_duplicate(msgs, dest_chat_id, dest_topic)]
+            if not todo:
+                return
+            async with limiter.slots():
+                done = await forward_batch(client, todo, dest_chat_id, dest_topic)
+            if done:
+                forwarded.update(msgs[0].id for msgs in todo)
+                return
+            if src_id in RESTRICTED_CHATS:
+                restricted_dests.append((dest_chat_id, dest_topic))
+                return
+            # Only the groups of the failed call are retried, on that destination alone
+            for msgs in todo:
+                await process_group(client, msgs, [(dest_chat_id, dest_topic)], src_title, src_topic)
+                fallback.add(msgs[0].id)
+        
+        # Destinations are independent, each one still gets its batches in order
+        await asyncio.gather(*(forward_to(dest_chat_id, dest_topic) for dest_chat_id, dest_topic in dest_chats))
+        
+        if restricted_dests:
+            await prefetch_groups(client, batch, restricted_dests, src_title, src_topic)
+            fallback.update(msgs[0].id for msgs in batch)
+        
+        # If SAVE_TO_LOCAL is enabled, download even after forwarding (process_group already did it for fallbacks)
+        if SAVE_TO_LOCAL:
+            for msgs in batch:
+                if msgs[0].id in forwarded and msgs[0].id not in fallback:
+                    await GroupMedia(msgs, src_title).save_local()
+        pbar.update(len(batch))
+
+async def run_groups(client, groups, dest_chats, src_title, src_topic, pbar):
+    """Process groups in order, runs of forwardable groups are batched and the rest goes through the prefetch pipeline"""
+    segment, batched = [], False
+    for msgs in groups:
+        can_batch = can_batch_forward(msgs)
+        if segment and can_batch != batched:
+            await run_segment(client, segment, batched, dest_chats, src_title, src_topic, pbar)
+            segment = []
+        segment.append(msgs)
+        batched = can_batch
+    if segment:
+        await run_segment(client, segment, batched, dest_chats, src_title, src_topic, pbar)
+
+async def run_segment(client, groups, batched, dest_chats, src_title, src_topic, pbar):
+    if batched:
+        await forward_in_batches(client, groups, dest_chats, src_title, src_topic, pbar)
+    else:
+        await prefetch_groups(client, groups, dest_chats, src_title, src_topic, pbar)
+
+async def prefetch_groups(client, groups, dest_chats, src_title, src_topic, pbar=None):
+    """Process groups in order while the next PREFETCH_GROUPS restricted groups download concurrently
+    in the background, each once the shared disk budget admits its size"""
+    if PREFETCH_GROUPS <= 0 or FORWARDING_ONLY:
+        for msgs in groups:
+            await process_group(client, msgs, dest_chats, src_title, src_topic)
+            if pbar:
+                pbar.update(1)
+        return
+
+    queue = asyncio.Queue(maxsize=PREFETCH_GROUPS)
+    src_id = groups[0][0].chat.id if groups else None
+
+    async def prefetch(msgs, ticket):
+        """Download one group once the disk budget has room for it, returns (files, reserved bytes)"""
+        reserved = await disk_budget.acquire(group_size(msgs), ticket)
+        files = None
+        try:
+            files = await download_group(msgs, src_title)
+        except FloodWait as e:
+            await metrics.sleep(e.value + 2, "floodwait", account=client.name)
+        except Exception as e:
+            # process_group downloads it again inline and reports the error
+            print(Fore.YELLOW + f"Prefetch failed for group {msgs[0].id}: {e}" + Style.RESET_ALL)
+        except BaseException:
+            await disk_budget.release(reserved)
+            raise
+        return files, reserved
+
+    async def producer():
+        try:
+            for msgs in groups:
+                task = None
+                if needs_download(client, msgs, dest_chats):
+                    task = asyncio.create_task(prefetch(msgs, disk_budget.ticket()))
+                try:
+                    await queue.put((msgs, task))
+                except BaseException:
+                    if task:
+                        task.cancel()
+                    raise
+                metrics.gauge("prefetch_queue_depth", queue.qsize(), source=src_id)
+        except Exception as e:
+            # Passed on in place of the end marker, the consumer would otherwise wait for it forever
+            await queue.put(e)
+            return
+        await queue.put(None)
+
+    producer_task = asyncio.create_task(producer())
+    pending = []
+    try:
+        while True:
+            item = await queue.get()
+            metrics.gauge("prefetch_queue_depth", queue.qsize(), source=src_id)
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            msgs, task = item
+            files, reserved = await task if task else (None, 0)
+            try:
+                await process_group(client, msgs, dest_chats, src_title, src_topic, prefetched=files)
+            finally:
+                cleanup_files(files)
+                await disk_budget.release(reserved)
+            if pbar:
+                pbar.update(1)
+        await producer_task
+    finally:
+        if not producer_task.done():
+            producer_task.cancel()
+        while not queue.empty():
+            item = queue.get_nowait()
+            if isinstance(item, tuple) and item[1]:
+                pending.append(item[1])
+                item[1].cancel()
+        for result in await asyncio.gather(*pending, return_exceptions=True):
+            if isinstance(result, tuple):
+                cleanup_files(result[0])
+                await disk_budget.release(result[1])
+
+class GroupMedia:
+    """Media of one group, downloaded at most once and re-sent to further destinations by file_id"""
+
+    def __init__(self, messages, src_title, prefetched=None):
+        self.messages = messages
+        self.src_title = src_title
+        self.files = prefetched
+        # Prefetched files belong to run_groups, which cleans them up itself
+        self.owns_files = False
+        self.file_ids = None
+        self.saved_local = False
+        self.upload_lock = asyncio.Lock()
+        self.save_lock = asyncio.Lock()
+
+    @contextlib.asynccontextmanager
+    async def first_upload(self):
+        """Destinations sent to concurrently take turns until one of them has uploaded the media,
+        the others then go through at once with its file_ids"""
+        await self.upload_lock.acquire()
+        if self.file_ids is not None:
+            self.upload_lock.release()
+            yield
+            return
         try:
-            kwargs = {}
-            if dest_topic:
-                kwargs["reply_to_message_id"] = dest_topic
+            yield
+        finally:
+            self.upload_lock.release()
+
+    async def input_media(self, client):
+        """Build the InputMedia list for send_media_group, downloading only if nothing was uploaded yet"""
+        if self.file_ids is None and MEDIA_CACHE:
+            self.reuse_uploads(client)
+        if self.file_ids is not None:
+            sources = self.file_ids
+        else:
+            if self.files is None:
+                self.files = await download_group(self.messages, self.src_title)
+                self.owns_files = True
+            sources = [(message, file_path) for message, file_path, _ in self.files]
+
+        media_list = []
+        caption_set = False
+        for message, media_source in sources:
+            caption = None if DROP_CAPTION else (message.caption or message.text)
+            entities = message.caption_entities or message.entities
             
-            forwarded_or_copied = False
+            # Create InputMedia for the album
+            if message.photo:
+                media = InputMediaPhoto(media_source)
+            else:
+                media = InputMediaVideo(media_source)
             
-            # --- STRATEGY 1: Internal Forward/Copy (when FORWARDING=True or FORWARDING_ONLY=True) ---
-            if FORWARDING or FORWARDING_ONLY:
-                try:
+            # Add caption only to the first media in the group
+            if caption and not caption_set:
+                media.caption = caption
+                media.parse_mode = ParseMode.HTML if entities else None
+                caption_set = True
+            
+            media_list.append(media)
+        return media_list
+
+    def forget_uploads(self, client):
+        """Drop file_ids Telegram refused, from the group and from the cache, so the media is uploaded again"""
+        media_cache.drop_uploads(client, self.messages)
+        self.file_ids = None
+
+    def reuse_uploads(self, client):
+        """Take the file_ids of an earlier upload of the same media from the cache, nothing has to be downloaded then"""
+        file_ids = []
+        for message in self.messages:
+            if message.photo or message.video:
+                file_id = media_cache.get_upload(client, message)
+                if file_id is None:
+                    return
+                file_ids.append((message, file_id))
+        if file_ids:
+            media_cache.upload_hits += len(file_ids)
+            self.file_ids = file_ids
+
+    def streamable(self, client):
+        """STREAM_UPLOAD: True if the media still has to be uploaded and nothing was downloaded to disk for it"""
+        if not STREAM_UPLOAD or self.files is not None:
+            return False
+        if self.file_ids is None and MEDIA_CACHE:
+            self.reuse_uploads(client)
+        return self.file_ids is None and any(m.photo or m.video for m in self.messages)
+
+    async def send_streamed(self, client, dest_chat_id, dest_topic):
+        """Upload the album to its first destination straight from stream_media, without temp files"""
+        async def upload(message):
+            # SAVE_TO_LOCAL: the archive copy is written from the same stream
+            tee_path = None
+            if SAVE_TO_LOCAL and not local_archive.find(self.src_title, message):
+                tee_path = local_archive.path(self.src_title, message)
+            input_file = await stream_upload(client, message, tee_path)
+            if tee_path:
+                media_cache.add_file(message, tee_path)
+                media_cache.release(message)
+                await local_archive.add(self.src_title, message, tee_path)
+            return input_file
+        return await self.send_uploaded(client, dest_chat_id, dest_topic, upload)
+
+    async def send_paced(self, client, dest_chat_id, dest_topic):
+        """UPLOAD_LIMIT_MBPS: upload the downloaded files part by part at the cap, send_media_group can't be paced"""
+        paths = {message.id: file_path for message, file_path, _ in self.files}
+        
+        async def upload(message):
+            return await client.save_file(paths[message.id], progress=upload_bandwidth.progress())
+        return await self.send_uploaded(client, dest_chat_id, dest_topic, upload)
+
+    async def send_uploaded(self, client, dest_chat_id, dest_topic, upload):
+        """Send the album with messages.SendMultiMedia, `upload(message)` returns the uploaded file of each media"""
+        peer = await client.resolve_peer(dest_chat_id)
+        multi_media = []
+        caption_set = False
+        for message in self.messages:
+            if not (message.photo or message.video):
+                continue
+            media = await upload_input_media(client, peer, message, await upload(message))
+            
+            # Add caption only to the first media in the group
+            caption = None if DROP_CAPTION else (message.caption or message.text)
+            text = {"message": "", "entities": None}
+            if caption and not caption_set:
+                entities = message.caption_entities or message.entities
+                if entities:
+                    text = await utils.parse_text_entities(client, caption, None, entities)
+                else:
+                    text["message"] = str(caption)
+                caption_set = True
+            multi_media.append(raw.types.InputSingleMedia(
+                media=media, random_id=client.rnd_id(), message=text["message"], entities=text["entities"]
+            ))
+        
+        r = await client.invoke(
+            raw.functions.messages.SendMultiMedia(peer=peer, multi_media=multi_media, reply_to_msg_id=dest_topic or None)
+        )
+        sent = await parse_sent(client, r)
+        self.remember_upload(client, sent)
+        return sent
+
+    def remember_upload(self, client, sent):
+        """Keep the file_ids of the first upload so other destinations don't upload the files again"""
+        media_messages = [m for m in self.messages if m.photo or m.video]
+        if self.file_ids is not None or not media_messages or not sent or len(sent) != len(media_messages):
+            return
+        file_ids = []
+        for message, sent_msg in zip(media_messages, sent):
+            media = sent_msg.photo or sent_msg.video
+            if not media:
+                return
+            file_ids.append((message, media.file_id))
+        self.file_ids = file_ids
+        for message, file_id in file_ids:
+            media_cache.add_upload(client, message, file_id)
+        # Temp files are no longer needed once the media lives on Telegram's servers
+        if self.owns_files:
+            cleanup_files(self.files)
+            self.owns_files = False
+
+    async def save_local(self):
+        """SAVE_TO_LOCAL after a forward/copy: download once per group, not once per destination"""
+        async with self.save_lock:
+            if self.saved_local:
+                return
+            for message in self.messages:
+                if message.photo or message.video:
+                    if local_archive.find(self.src_title, message):
+                        continue
+                    permanent_path = local_archive.path(self.src_title, message)
+                    cached = media_cache.get_file(message)
+                    if cached:
+                        link_or_copy(cached, permanent_path)
+                    else:
+                        await download_media(message, permanent_path)
+                        media_cache.add_file(message, permanent_path)
+                    media_cache.release(message)
+                    await local_archive.add(self.src_title, message, permanent_path)
+            self.saved_local = True
+
+    def cleanup(self):
+        if self.owns_files:
+            cleanup_files(self.files)
+
+async def process_group(client, messages, dest_chats, src_title, src_topic, prefetched=None):
+    if not messages:
+        return
+
+    # Check if we should process this group based on media type filters
+    if not should_process_group(messages):
+        return
+
+    dest_chats = [(dest_chat_id, dest_topic) for dest_chat_id, dest_topic in pending_destinations(messages, dest_chats)
+                  if not skip_duplicate(messages, dest_chat_id, dest_topic)]
+    if not dest_chats:
+        return
+
+    group_media = GroupMedia(messages, src_title, prefetched)
+    
+    async def deliver(dest_chat_id, dest_topic):
+        # A FloodWait only holds back its own destination, the retry waits until its bucket allows it.
+        # Nothing is dropped: the group is retried until it goes through.
+        while True:
+            async with limiter.slots():
+                result = await send_to_destination(client, messages, dest_chat_id, dest_topic, group_media)
+            if result != "retry":
+                return
+    
+    # All destinations at once; the group is finished everywhere before the next one starts, so each keeps its order
+    try:
+        await asyncio.gather(*(deliver(dest_chat_id, dest_topic) for dest_chat_id, dest_topic in dest_chats))
+    finally:
+        group_media.cleanup()
+
+async def send_to_destination(client, messages, dest_chat_id, dest_topic, group_media):
+    """Send one group to one destination, returns "ok", "retry" after a FloodWait or "skip" to drop the group for all destinations"""
+    first_msg = messages[0]
+    
+    try:
+        kwargs = {}
+        if dest_topic:
+            kwargs["reply_to_message_id"] = dest_topic
+        
+        forwarded_or_copied = False
+        
+        # --- STRATEGY 1: Internal Forward/Copy (when FORWARDING=True or FORWARDING_ONLY=True) ---
+        if (FORWARDING or FORWARDING_ONLY) and first_msg.chat.id not in RESTRICTED_CHATS:
+            try:
+                await limiter.acquire(client, dest_chat_id)
+                method = "forward" if not HIDE_SENDER else "copy_media_group" if len(messages) > 1 else "copy_message"
+                with metrics.timer("send_seconds", method=method, destination=dest_chat_id, account=client.name):
                     if HIDE_SENDER:
                         # For albums (multiple messages with media_group_id), use copy_media_group
                         if len(messages) > 1:
                             # Copy entire album - preserves grid/album structure
-                            await client.copy_media_group(
+                            sent = await client.copy_media_group(
                                 chat_id=dest_chat_id,
                                 from_chat_id=first_msg.chat.id,
                                 message_id=first_msg.id,
@@ -207,7 +1892,7 @@ async def process_group(client, messages, dest_chats, src_title, src_topic):
                         else:
                             # Single message - use copy_message
                             caption = "" if DROP_CAPTION else None
-                            await client.copy_message(
+                            sent = await client.copy_message(
                                 chat_id=dest_chat_id,
                                 from_chat_id=first_msg.chat.id,
                                 message_id=first_msg.id,
@@ -217,221 +1902,637 @@ async def process_group(client, messages, dest_chats, src_title, src_topic):
                         forwarded_or_copied = True
                     else:
                         # Forward with author - preserves albums automatically
-                        await client.forward_messages(
-                            chat_id=dest_chat_id,
-                            from_chat_id=first_msg.chat.id,
-                            message_ids=[m.id for m in messages],
-                            drop_author=False,
-                            **kwargs
-                        )
+                        sent = await forward_raw(client, first_msg.chat.id, [m.id for m in messages],
+                                                 dest_chat_id, dest_topic, drop_author=False)
                         forwarded_or_copied = True
-                    
-                    # If SAVE_TO_LOCAL is enabled, download even after forwarding
-                    if SAVE_TO_LOCAL and forwarded_or_copied:
-                        safe_title = src_title.replace(" ", "_").replace("/", "_").replace("|", "_").replace("\\", "_").replace(":", "_")
-                        save_dir = os.path.join("downloads", safe_title)
-                        os.makedirs(save_dir, exist_ok=True)
-                        for message in messages:
-                            if message.photo or message.video:
-                                ext = ".jpg" if message.photo else ".mp4"
-                                permanent_path = os.path.join(save_dir, f"{message.id}{ext}")
-                                await message.download(permanent_path)
-                    
-                    # Successfully handled via forward/copy, skip to next destination
-                    if forwarded_or_copied:
-                        continue
                 
-                except ChatForwardsRestricted:
-                    if FORWARDING_ONLY:
-                        print(Fore.YELLOW + f"Forwarding failed for group {first_msg.id}, skipping due to FORWARDING_ONLY." + Style.RESET_ALL)
-                        return
-                    # If not FORWARDING_ONLY, continue to Strategy 2 (download & upload)
-                except Exception as e:
-                    if FORWARDING_ONLY:
-                        print(Fore.RED + f"Forwarding failed for group {first_msg.id}: {e}" + Style.RESET_ALL)
-                        return
-                    # If not FORWARDING_ONLY, continue to Strategy 2
-            
-            # --- STRATEGY 2: Download & Upload (only if Strategy 1 failed and FORWARDING_ONLY=False) ---
-            if not FORWARDING_ONLY and not forwarded_or_copied:
-                save_dir = None
-                file_paths = []
-                media_list = []
-                caption_set = False
+                # If SAVE_TO_LOCAL is enabled, download even after forwarding
+                if SAVE_TO_LOCAL and forwarded_or_copied:
+                    await group_media.save_local()
                 
-                if SAVE_TO_LOCAL:
-                    safe_title = src_title.replace(" ", "_").replace("/", "_").replace("|", "_").replace("\\", "_").replace(":", "_")
-                    save_dir = os.path.join("downloads", safe_title)
-                    os.makedirs(save_dir, exist_ok=True)
-                
-                for message in messages:
-                    caption = None if DROP_CAPTION else (message.caption or message.text)
-                    entities = message.caption_entities or message.entities
-                    
-                    if message.photo or message.video:
-                        ext = ".jpg" if message.photo else ".mp4"
-                        
-                        if SAVE_TO_LOCAL:
-                            file_path = os.path.join(save_dir, f"{message.id}{ext}")
-                        else:
-                            file_path = os.path.join("downloads", f"temp_{'p' if message.photo else 'v'}_{message.id}{ext}")
-                            file_paths.append(file_path)
-                        
-                        await message.download(file_path)
-                        
-                        # Create InputMedia for the album
-                        if message.photo:
-                            media = InputMediaPhoto(file_path)
-                        else:
-                            media = InputMediaVideo(file_path)
-                        
-                        # Add caption only to the first media in the group
-                        if caption and not caption_set:
-                            media.caption = caption
-                            media.parse_mode = ParseMode.HTML if entities else None
-                            caption_set = True
-                        
-                        media_list.append(media)
+                # Successfully handled via forward/copy, skip to next destination
+                if forwarded_or_copied:
+                    limiter.on_success(client, dest_chat_id)
+                    journal.record(messages, dest_chat_id, dest_topic, "done", sent)
+                    media_cache.mark_sent(messages, dest_chat_id, dest_topic)
+                    return "ok"
+            
+            except ChatForwardsRestricted:
+                RESTRICTED_CHATS.add(first_msg.chat.id)
+                if FORWARDING_ONLY:
+                    print(Fore.YELLOW + f"Forwarding failed for group {first_msg.id}, skipping due to FORWARDING_ONLY." + Style.RESET_ALL)
+                    journal.record(messages, dest_chat_id, dest_topic, "skipped")
+                    return "skip"
+                # If not FORWARDING_ONLY, continue to Strategy 2 (download & upload)
+            except FloodWait:
+                raise
+            except Exception as e:
+                if FORWARDING_ONLY:
+                    print(Fore.RED + f"Forwarding failed for group {first_msg.id}: {e}" + Style.RESET_ALL)
+                    journal.record(messages, dest_chat_id, dest_topic, "skipped")
+                    return "skip"
+                # If not FORWARDING_ONLY, continue to Strategy 2
+        
+        # --- STRATEGY 2: Download & Upload (only if Strategy 1 failed and FORWARDING_ONLY=False) ---
+        if not FORWARDING_ONLY and not forwarded_or_copied:
+            async def send_media():
+                """Send the group's media, returns (sent, media_list)"""
+                if group_media.streamable(client):
+                    # STREAM_UPLOAD: media goes from stream_media straight into the upload, no temp files
+                    await limiter.acquire(client, dest_chat_id)
+                    with metrics.timer("send_seconds", method="stream", destination=dest_chat_id, account=client.name):
+                        return await group_media.send_streamed(client, dest_chat_id, dest_topic), None
+                media_list = await group_media.input_media(client)
                 
                 # Send as media group (album) if we have media
-                if media_list:
+                if not media_list:
+                    return None, media_list
+                await limiter.acquire(client, dest_chat_id)
+                uploading = group_media.file_ids is None
+                if uploading and upload_bandwidth.rate > 0:
+                    with metrics.timer("send_seconds", method="paced_upload", destination=dest_chat_id, account=client.name):
+                        sent = await group_media.send_paced(client, dest_chat_id, dest_topic)
+                else:
+                    with metrics.timer("send_seconds", method="send_media_group", destination=dest_chat_id, account=client.name):
+                        sent = await client.send_media_group(dest_chat_id, media_list, **kwargs)
+                    group_media.remember_upload(client, sent)
+                if uploading:
+                    metrics.count("upload_bytes_total", group_size(messages), account=client.name)
+                return sent, media_list
+            
+            async with group_media.first_upload():
+                try:
                     try:
-                        await client.send_media_group(dest_chat_id, media_list, **kwargs)
+                        sent, media_list = await send_media()
                     except (MediaEmpty, BadRequest) as e:
-                        if "MEDIA_EMPTY" in str(e):
-                            print(Fore.YELLOW + f"{first_msg.id} - [400 MEDIA_EMPTY]" + Style.RESET_ALL)
-                        else:
+                        if group_media.file_ids is None or not stale_file_id(e):
                             raise
-                
-                # Cleanup temp files if not saving
-                if not SAVE_TO_LOCAL:
-                    for file_path in file_paths:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                
-                # Handle text-only messages (not part of media group)
-                if not media_list and first_msg.text:
-                    await client.send_message(
+                        # The file reference inside a file_id expires: forget them and upload the media again, once
+                        print(Fore.YELLOW + f"{first_msg.id} - earlier upload refused ({e}), uploading again." + Style.RESET_ALL)
+                        group_media.forget_uploads(client)
+                        sent, media_list = await send_media()
+                except (MediaEmpty, BadRequest) as e:
+                    if "MEDIA_EMPTY" in str(e):
+                        print(Fore.YELLOW + f"{first_msg.id} - [400 MEDIA_EMPTY]" + Style.RESET_ALL)
+                        journal.record(messages, dest_chat_id, dest_topic, "failed")
+                        return "ok"
+                    else:
+                        raise
+            
+            # Handle text-only messages (not part of media group)
+            if sent is None and not media_list and first_msg.text:
+                await limiter.acquire(client, dest_chat_id)
+                with metrics.timer("send_seconds", method="send_message", destination=dest_chat_id, account=client.name):
+                    sent = await client.send_message(
                         dest_chat_id, 
                         first_msg.text,
                         parse_mode=ParseMode.HTML if first_msg.entities else None,
                         **kwargs
                     )
+            
+            limiter.on_success(client, dest_chat_id)
+            journal.record(messages, dest_chat_id, dest_topic, "done", sent)
+            media_cache.mark_sent(messages, dest_chat_id, dest_topic)
+    
+    except FloodWait as e:
+        print(Fore.YELLOW + f"FloodWait on {dest_chat_id}: retrying group {first_msg.id} in {e.value} seconds..." + Style.RESET_ALL)
+        limiter.on_flood(client, dest_chat_id, e.value + 1)
+        journal.record(messages, dest_chat_id, dest_topic, "failed")
+        return "retry"
+    except ChannelPrivate:
+        print(Fore.RED + f"Can't write to private destination: {dest_chat_id}" + Style.RESET_ALL)
+        journal.record(messages, dest_chat_id, dest_topic, "failed")
+    except ChatWriteForbidden:
+        print(Fore.RED + f"No permission to send in destination: {dest_chat_id}" + Style.RESET_ALL)
+        journal.record(messages, dest_chat_id, dest_topic, "failed")
+    except Exception as e:
+        if "MEDIA_EMPTY" in str(e):
+            print(Fore.YELLOW + f"{first_msg.id} - [400 MEDIA_EMPTY]" + Style.RESET_ALL)
+        else:
+            print(Fore.RED + f"Error sending group {first_msg.id}: {e}" + Style.RESET_ALL)
+        journal.record(messages, dest_chat_id, dest_topic, "failed")
+    
+    return "ok"
+
+async def fetch_messages(client, chat_id, message_ids, **kwargs):
+    """get_messages that waits out FloodWaits instead of aborting the transfer"""
+    while True:
+        try:
+            with metrics.timer("fetch_seconds", source=chat_id, account=client.name):
+                return await client.get_messages(chat_id, message_ids, **kwargs)
+        except FloodWait as e:
+            print(Fore.YELLOW + f"FloodWait while fetching: sleeping {e.value} seconds..." + Style.RESET_ALL)
+            await metrics.sleep(e.value + 1, "floodwait", account=client.name)
+
+def ask_range(src_id):
+    """Prompt for a message ID range, with --resume pressing Enter reuses the last range of this source"""
+    last_range = journal.last_range(src_id) if RESUME else None
+    print(Fore.GREEN + Style.BRIGHT + "[ Example: 1-100 ]" + Style.RESET_ALL)
+    if last_range:
+        print(Fore.GREEN + Style.BRIGHT + f"[ Resume: press Enter to continue {last_range[0]}-{last_range[1]} ]" + Style.RESET_ALL)
+    input_str = input(Fore.GREEN + Style.BRIGHT + "Please enter message ID range: " + Style.RESET_ALL).strip()
+    
+    if not input_str and last_range:
+        return last_range
+    
+    try:
+        parts = input_str.split("-")
+        if len(parts) != 2:
+            raise ValueError
+        start_id = int(parts[0].strip())
+        end_id = int(parts[1].strip())
+    except:
+        print(Fore.RED + "Invalid format. Use 1-100." + Style.RESET_ALL)
+        return None
+    
+    if start_id > end_id:
+        print(Fore.RED + "Start ID cannot be greater than end ID." + Style.RESET_ALL)
+        return None
+    
+    journal.save_range(src_id, start_id, end_id)
+    return start_id, end_id
+
+async def id_chunks(client, src_id, start_id, end_id, src_topic=None):
+    """SCAN_MODE=ids: probe every ID of the range with get_messages, 100 at a time.
+    get_messages can't select a topic, so other topics' messages are filtered out here."""
+    chunk_start = start_id
+    while chunk_start <= end_id:
+        chunk_end = min(chunk_start + 99, end_id)
+        # replies=0: the replied-to messages are never used and would cost a request per chunk in a topic
+        chunk_msgs = await fetch_messages(client, src_id, list(range(chunk_start, chunk_end + 1)), replies=0)
+        if chunk_msgs is not None:
+            if not isinstance(chunk_msgs, list):
+                chunk_msgs = [chunk_msgs]
+            yield [m for m in chunk_msgs if m and not m.empty and in_topic(m, src_topic)]
+        chunk_start = chunk_end + 1
+
+def scan_filter():
+    """Server-side search filter matching PHOTOS/VIDEOS, None when text posts are wanted too"""
+    if TEXT or not (PHOTOS or VIDEOS):
+        return None
+    if PHOTOS and VIDEOS:
+        return MessagesFilter.PHOTO_VIDEO
+    return MessagesFilter.PHOTO if PHOTOS else MessagesFilter.VIDEO
+
+async def scan_chunks(client, src_id, start_id, end_id, src_topic=None):
+    """SCAN_MODE=server: page through the range with history/search requests, so deleted IDs cost nothing
+    and, with TEXT=False, only photos/videos matching the filters are returned"""
+    peer = await client.resolve_peer(src_id)
+    msg_filter = scan_filter()
+    offset_id = start_id
+    while offset_id <= end_id:
+        # add_offset=-limit turns the page around: the 100 messages from offset_id upwards
+        page_kwargs = dict(offset_id=offset_id, add_offset=-100, limit=100, max_id=end_id + 1, min_id=start_id - 1, hash=0)
+        if msg_filter:
+            query = raw.functions.messages.Search(peer=peer, q="", filter=msg_filter.value(), min_date=0, max_date=0,
+                                                  top_msg_id=src_topic, **page_kwargs)
+        elif src_topic:
+            query = raw.functions.messages.GetReplies(peer=peer, msg_id=src_topic, offset_date=0, **page_kwargs)
+        else:
+            query = raw.functions.messages.GetHistory(peer=peer, offset_date=0, **page_kwargs)
         
+        try:
+            with metrics.timer("fetch_seconds", source=src_id, account=client.name):
+                r = await client.invoke(query)
         except FloodWait as e:
-            print(Fore.YELLOW + f"FloodWait: sleeping {e.value} seconds..." + Style.RESET_ALL)
-            await asyncio.sleep(e.value + 2)
-        except ChannelPrivate:
-            print(Fore.RED + f"Can't write to private destination: {dest_chat_id}" + Style.RESET_ALL)
-        except ChatWriteForbidden:
-            print(Fore.RED + f"No permission to send in destination: {dest_chat_id}" + Style.RESET_ALL)
-        except Exception as e:
-            if "MEDIA_EMPTY" in str(e):
-                print(Fore.YELLOW + f"{first_msg.id} - [400 MEDIA_EMPTY]" + Style.RESET_ALL)
-            else:
-                print(Fore.RED + f"Error sending group {first_msg.id}: {e}" + Style.RESET_ALL)
+            print(Fore.YELLOW + f"FloodWait while scanning: sleeping {e.value} seconds..." + Style.RESET_ALL)
+            await metrics.sleep(e.value + 1, "floodwait", account=client.name)
+            continue
         
-        await asyncio.sleep(random.uniform(1.0, 2.5))
+        page = await utils.parse_messages(client, r, replies=0)
+        page = sorted((m for m in page if m and not m.empty and offset_id <= m.id <= end_id), key=lambda m: m.id)
+        if not page:
+            break
+        yield page
+        offset_id = page[-1].id + 1
 
-async def transfer_content(client: Client):
+async def iter_messages(client, src_id, start_id, end_id, src_topic=None):
+    """Yield the existing messages of an ID range in order, fetching up to FETCH_AHEAD chunks in the background"""
+    queue = asyncio.Queue(maxsize=max(1, FETCH_AHEAD))
+    if SCAN_MODE == "server":
+        chunks = scan_chunks(client, src_id, start_id, end_id, src_topic)
+    else:
+        chunks = id_chunks(client, src_id, start_id, end_id, src_topic)
+    
+    async def producer():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as e:
+            # Passed on in place of the end marker, the consumer would otherwise wait for it forever
+            await queue.put(e)
+            return
+        await queue.put(None)
+    
+    producer_task = asyncio.create_task(producer())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            for message in chunk:
+                yield message
+        await producer_task
+    finally:
+        if not producer_task.done():
+            producer_task.cancel()
+
+async def iter_groups(client, src_id, start_id, end_id, src_topic=None, whole_albums=False, album_tail=True):
+    """Yield complete groups (albums or single messages) of an ID range in order.
+    An album stays open until a message of another group shows up, so albums crossing
+    chunk boundaries are never split. With whole_albums an album belongs to the range
+    holding its first message: albums started before start_id are left out and an album
+    still open at end_id is completed from the following IDs, unless album_tail is False."""
+    # Albums hold at most 10 messages
+    fetch_start = max(1, start_id - 9) if whole_albums else start_id
+    earlier_albums = set()
+    open_group = []
+    
+    async for message in iter_messages(client, src_id, fetch_start, end_id, src_topic):
+        if message.id < start_id:
+            if message.media_group_id:
+                earlier_albums.add(message.media_group_id)
+            continue
+        if message.media_group_id and message.media_group_id in earlier_albums:
+            continue
+        if open_group and message.media_group_id and message.media_group_id == open_group[0].media_group_id:
+            open_group.append(message)
+            continue
+        if open_group:
+            yield open_group
+        open_group = [message]
+    
+    if whole_albums and album_tail and open_group and open_group[0].media_group_id:
+        tail = await fetch_messages(client, src_id, list(range(end_id + 1, end_id + 10)), replies=0) or []
+        for message in tail:
+            if not message or message.empty or not in_topic(message, src_topic):
+                continue
+            if message.media_group_id != open_group[0].media_group_id:
+                break
+            open_group.append(message)
+    
+    if open_group:
+        yield open_group
+
+async def transfer_window(client, source, dest_chats, groups):
+    src_id, src_topic, src_title = source
+    window_start, window_end = groups[0][0].id, groups[-1][-1].id
+    # Sizes come from the fetched metadata, so the volume is known before anything is downloaded
+    downloading = not FORWARDING_ONLY and (not FORWARDING or src_id in RESTRICTED_CHATS)
+    media_bytes = sum(group_size(msgs) for msgs in groups)
+    eta = download_bandwidth.eta(media_bytes) if downloading else None
+    volume = f"{media_bytes / 1024 / 1024:.1f} MB of media" + (f", ~{eta:.0f}s at DOWNLOAD_LIMIT_MBPS" if eta else "")
+    print(Fore.YELLOW + Style.BRIGHT + f"Processing batch {window_start} → {window_end} ({volume})" + Style.RESET_ALL)
+    
+    with tqdm(total=len(groups), desc=Fore.BLUE + Style.BRIGHT + "Transferring", unit="group",
+              bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]" + Style.RESET_ALL) as pbar:
+        await run_groups(client, groups, dest_chats, src_title, src_topic, pbar)
+    
+    journal.flush()
+    media_cache.flush()
+    print(Fore.CYAN + Style.BRIGHT + f"Finished batch {window_start} → {window_end}: {len(groups)} groups processed." + Style.RESET_ALL)
+    limiter.print_report()
+    media_cache.print_stats()
+    if downloading:
+        disk_budget.print_report()
+    metrics.export()
+
+async def transfer_range(client, source, dest_chats, start_id, end_id, whole_albums=False, handoff=None, album_tail=True):
+    """Stream an ID range through run_groups in batches of about 200 messages while the next chunks are fetched.
+    Returns None when the range is done, or the first ID left unprocessed when handoff() asked to stop early."""
+    src_id, src_topic, src_title = source
+    batch_size = 200
+    window, window_size = [], 0
+    groups = iter_groups(client, src_id, start_id, end_id, src_topic, whole_albums, album_tail)
+    try:
+        async for msgs in groups:
+            if window and window_size + len(msgs) > batch_size:
+                await transfer_window(client, source, dest_chats, window)
+                window, window_size = [], 0
+                if handoff and handoff():
+                    return msgs[0].id
+            window.append(msgs)
+            window_size += len(msgs)
+        if window:
+            await transfer_window(client, source, dest_chats, window)
+    finally:
+        await groups.aclose()
+    return None
+
+async def prepare_client(client):
+    """Refresh the account cache and resolve DESTINATIONS, returns the resolved destinations"""
     # Update account cache on every session start
-    me = await client.get_me()
+    me = await retry_floodwait(client.get_me)
     session_name = client.name
     update_account_cache(session_name, me)
     
-    print(Fore.YELLOW + Style.BRIGHT + "Loading dialogs to cache chats/channels..." + Style.RESET_ALL)
-    async for _ in client.get_dialogs():
-        pass
-    print(Fore.GREEN + Style.BRIGHT + "Dialogs loaded." + Style.RESET_ALL)
-    
     dest_chats = []
     for dest in DESTINATIONS:
         resolved_id, resolved_topic, _ = await resolve_chat(client, dest)
         if resolved_id:
             dest_chats.append((resolved_id, resolved_topic))
+    return dest_chats
+
+async def transfer_content(client: Client):
+    dest_chats = await prepare_client(client)
     
     if not dest_chats:
         print(Fore.RED + Style.BRIGHT + "No valid destinations resolved. Check DESTINATIONS in .env." + Style.RESET_ALL)
         return
     
+    # Ask every range upfront so the transfers themselves run unattended
+    jobs = []
     for source in SOURCES:
         src_id, src_topic, src_title = await resolve_chat(client, source)
         if not src_id:
             continue
         
-        get_kwargs = {}
-        if src_topic:
-            get_kwargs["reply_to_message_id"] = src_topic
-        
         print(Fore.CYAN + Style.BRIGHT + f"\nProcessing source: {src_id} (topic: {src_topic or 'general'}, title: {src_title})" + Style.RESET_ALL)
-        print(Fore.GREEN + Style.BRIGHT + "[ Example: 1-100 ]" + Style.RESET_ALL)
-        input_str = input(Fore.GREEN + Style.BRIGHT + "Please enter message ID range: " + Style.RESET_ALL).strip()
-        
-        try:
-            parts = input_str.split("-")
-            if len(parts) != 2:
-                raise ValueError
-            start_id = int(parts[0].strip())
-            end_id = int(parts[1].strip())
-        except:
-            print(Fore.RED + "Invalid format. Use 1-100." + Style.RESET_ALL)
+        id_range = ask_range(src_id)
+        if not id_range:
             continue
+        jobs.append(((src_id, src_topic, src_title), id_range))
+    
+    # PARALLEL_SOURCES sources run at the same time, sends stay under the shared SEND_CONCURRENCY cap
+    source_slots = asyncio.Semaphore(max(1, PARALLEL_SOURCES))
+    
+    async def run_source(source, id_range):
+        async with source_slots:
+            start_id, end_id = id_range
+            total_messages = end_id - start_id + 1
+            print(Fore.YELLOW + Style.BRIGHT + f"Transferring {source[2]}: messages {start_id} → {end_id} ({total_messages} messages)" + Style.RESET_ALL)
+            
+            await transfer_range(client, source, dest_chats, start_id, end_id)
+            
+            print(Fore.CYAN + Style.BRIGHT + f"Finished source '{source[2]}'." + Style.RESET_ALL)
+    
+    await asyncio.gather(*(run_source(source, id_range) for source, id_range in jobs))
+
+def in_topic(message, topic):
+    """True if a message belongs to the topic (any message when no topic is set)"""
+    if not topic:
+        return True
+    return message.id == topic or topic in (message.reply_to_top_message_id, message.reply_to_message_id)
+
+async def latest_message_id(client, chat_id):
+    while True:
+        try:
+            async for message in client.get_chat_history(chat_id, limit=1):
+                return message.id
+            return 0
+        except FloodWait as e:
+            await metrics.sleep(e.value + 1, "floodwait", account=client.name)
+
+class SourceFollower:
+    """Live updates of one source, delivered in message order: albums wait FOLLOW_ALBUM_WAIT
+    seconds for their last part, gaps (missed updates, reconnects) are filled from the history"""
+    # How long a closed album is remembered, so a part arriving after FOLLOW_ALBUM_WAIT is never sent on its own
+    CLOSED_ALBUM_SECONDS = 300
+
+    def __init__(self, client, source, dest_chats):
+        self.client = client
+        self.source = source
+        self.dest_chats = dest_chats
+        self.queue = asyncio.Queue()
+        self.albums = {}
+        self.closed_albums = {}
+        self.last_id = 0
+
+    def on_message(self, message):
+        src_id, src_topic, _ = self.source
+        if message.empty or message.service or not in_topic(message, src_topic):
+            return
+        if not message.media_group_id:
+            group = asyncio.get_running_loop().create_future()
+            group.set_result([message])
+            self.queue.put_nowait(group)
+            return
+        closed = self.closed_albums.get(message.media_group_id)
+        if closed:
+            album = closed[1]
+            if album["taken"]:
+                print(Fore.YELLOW + f"Late part {message.id} of album {message.media_group_id} arrived after it was sent, skipping it." + Style.RESET_ALL)
+            else:
+                # Still waiting in the queue, the part joins its album
+                album["messages"].append(message)
+                album["messages"].sort(key=lambda m: m.id)
+            return
+        album = self.albums.get(message.media_group_id)
+        if album is None:
+            # Queued at its first part so later posts can't overtake it
+            album = {"messages": [], "future": asyncio.get_running_loop().create_future(), "timer": None, "taken": False}
+            self.albums[message.media_group_id] = album
+            self.queue.put_nowait(album["future"])
+        album["messages"].append(message)
+        if album["timer"]:
+            album["timer"].cancel()
+        album["timer"] = asyncio.get_running_loop().call_later(FOLLOW_ALBUM_WAIT, self.close_album, message.media_group_id)
+
+    def close_album(self, media_group_id):
+        now = time.monotonic()
+        for key, (closed_at, _) in list(self.closed_albums.items()):
+            if now - closed_at > self.CLOSED_ALBUM_SECONDS:
+                del self.closed_albums[key]
+        album = self.albums.pop(media_group_id)
+        album["messages"].sort(key=lambda m: m.id)
+        self.closed_albums[media_group_id] = (now, album)
+        album["future"].set_result(album["messages"])
+
+    async def catch_up(self, until=None):
+        """Send everything between the last processed id and `until` (the newest message of the source by default).
+        An explicit `until` is the gap before a live group, so an album open there is not completed past it."""
+        album_tail = until is None
+        if until is None:
+            until = await latest_message_id(self.client, self.source[0])
+        if until > self.last_id:
+            await transfer_range(self.client, self.source, self.dest_chats, self.last_id + 1, until,
+                                 whole_albums=True, album_tail=album_tail)
+            self.advance(until)
+
+    def advance(self, last_id):
+        if last_id > self.last_id:
+            self.last_id = last_id
+            journal.save_last_seen(self.source[0], self.source[1], last_id)
+
+    async def run(self):
+        src_id, src_topic, src_title = self.source
+        last_id = journal.last_seen(src_id, src_topic)
+        if last_id is None:
+            # First run: follow from now on, the history is what option 2 is for
+            self.advance(await latest_message_id(self.client, src_id))
+        else:
+            self.last_id = last_id
+            await self.catch_up()
         
-        if start_id > end_id:
-            print(Fore.RED + "Start ID cannot be greater than end ID." + Style.RESET_ALL)
+        while True:
+            try:
+                group = await asyncio.wait_for(self.queue.get(), FOLLOW_CATCHUP_SECONDS)
+            except asyncio.TimeoutError:
+                # Quiet for a while: make sure no update was lost while the connection was down
+                await self.catch_up()
+                continue
+            msgs = await group
+            if msgs[0].media_group_id in self.closed_albums:
+                # From here on a late part can't be added to the list being sent
+                self.closed_albums[msgs[0].media_group_id][1]["taken"] = True
+            # Updates lost on a reconnect show up as a gap before the next live one
+            await self.catch_up(msgs[0].id - 1)
+            # The journal drops anything a catch-up already sent
+            await process_group(self.client, msgs, self.dest_chats, src_title, src_topic)
+            journal.flush()
+            media_cache.flush()
+            metrics.export()
+            self.advance(msgs[-1].id)
+
+async def follow_sources(client):
+    """Mirror new posts of every source as they arrive, until interrupted"""
+    global RESUME
+    # Every send is checked against the journal so nothing goes out twice
+    RESUME = True
+    dest_chats = await prepare_client(client)
+    if not dest_chats:
+        print(Fore.RED + Style.BRIGHT + "No valid destinations resolved. Check DESTINATIONS in .env." + Style.RESET_ALL)
+        return
+    
+    followers = {}
+    for source in SOURCES:
+        src_id, src_topic, src_title = await resolve_chat(client, source)
+        if src_id:
+            followers.setdefault(src_id, []).append(SourceFollower(client, (src_id, src_topic, src_title), dest_chats))
+    if not followers:
+        return
+    
+    async def on_message(_, message):
+        for follower in followers.get(message.chat.id, []):
+            follower.on_message(message)
+    
+    client.add_handler(MessageHandler(on_message, filters.chat(list(followers))))
+    print(Fore.GREEN + Style.BRIGHT + f"Following {sum(len(f) for f in followers.values())} source(s), press Ctrl+C to stop." + Style.RESET_ALL)
+    await asyncio.gather(*(follower.run() for group in followers.values() for follower in group))
+
+async def start_clients():
+    """Connect every authorized session listed in accounts.json"""
+    clients = []
+    for session_name in load_accounts():
+        if not os.path.exists(os.path.join("sessions", f"{session_name}.session")):
             continue
+        client = Client(name=session_name, api_id=API_ID, api_hash=API_HASH, workdir="sessions",
+                        max_concurrent_transmissions=max(1, DOWNLOAD_CONNECTIONS), sleep_threshold=0)
+        try:
+            if not await client.connect():
+                print(Fore.YELLOW + f"Session '{session_name}' is not logged in, skipping." + Style.RESET_ALL)
+                await client.disconnect()
+                continue
+            await client.initialize()
+            clients.append(client)
+        except Exception as e:
+            print(Fore.RED + f"Could not start session '{session_name}': {e}" + Style.RESET_ALL)
+    return clients
+
+async def shard_worker(client, sources, dest_chats, queue):
+    """Take shards from the shared queue, handing the rest of a shard back while this account sits in a long FloodWait
+    and putting a failed shard back for up to MAX_RETRIES attempts"""
+    def handoff():
+        return limiter.blocked_for(client) > SHARD_HANDOFF_SECONDS
+    
+    while True:
+        source_index, start_id, end_id, attempt = await queue.get()
+        try:
+            if handoff():
+                rest_start = start_id
+            else:
+                rest_start = await transfer_range(client, sources[source_index], dest_chats, start_id, end_id,
+                                                  whole_albums=True, handoff=handoff)
+            if rest_start is not None:
+                print(Fore.YELLOW + f"[{client.name}] FloodWait of {int(limiter.blocked_for(client))}s, handing {rest_start} → {end_id} to the other accounts." + Style.RESET_ALL)
+                queue.put_nowait((source_index, rest_start, end_id, attempt))
+        except Exception as e:
+            # Groups already sent are in the journal, so a retry of the whole shard only sends what is missing
+            if attempt + 1 < MAX_RETRIES:
+                print(Fore.YELLOW + f"[{client.name}] Shard {start_id} → {end_id} failed ({e}), queuing it again (attempt {attempt + 2}/{MAX_RETRIES})." + Style.RESET_ALL)
+                queue.put_nowait((source_index, start_id, end_id, attempt + 1))
+            else:
+                print(Fore.RED + f"[{client.name}] Shard {start_id} → {end_id} failed after {MAX_RETRIES} attempts: {e}" + Style.RESET_ALL)
+        finally:
+            queue.task_done()
         
-        total_messages = end_id - start_id + 1
-        print(Fore.YELLOW + Style.BRIGHT + f"Transferring messages {start_id} → {end_id} ({total_messages} messages)" + Style.RESET_ALL)
+        # A throttled account sits out until its FloodWait is over, the others keep draining the queue
+        blocked = limiter.blocked_for(client)
+        if blocked:
+            await metrics.sleep(blocked, "handoff", account=client.name)
+
+async def multi_account_transfer():
+    global RESUME
+    # A failed shard is retried from its start, the journal keeps its sent groups from going out twice
+    RESUME = True
+    clients = await start_clients()
+    if not clients:
+        print(Fore.RED + Style.BRIGHT + "No logged in sessions found. Please create one first." + Style.RESET_ALL)
+        return
+    
+    try:
+        print(Fore.GREEN + Style.BRIGHT + f"Using {len(clients)} accounts: {', '.join(c.name for c in clients)}" + Style.RESET_ALL)
         
-        batch_size = 200
-        batches = []
-        current_start = start_id
+        # Every account needs its own access hashes for the sources and destinations
+        workers_setup = []
+        for client in clients:
+            dest_chats = await prepare_client(client)
+            sources = []
+            for source in SOURCES:
+                sources.append(await resolve_chat(client, source))
+            if dest_chats:
+                workers_setup.append((client, sources, dest_chats))
         
-        while current_start <= end_id:
-            current_end = min(current_start + batch_size - 1, end_id)
-            batches.append((current_start, current_end))
-            current_start = current_end + 1
+        if not workers_setup:
+            print(Fore.RED + Style.BRIGHT + "No valid destinations resolved. Check DESTINATIONS in .env." + Style.RESET_ALL)
+            return
         
-        for batch_start, batch_end in batches:
-            print(Fore.YELLOW + Style.BRIGHT + f"Processing batch {batch_start} → {batch_end}" + Style.RESET_ALL)
-            
-            # Fetch messages in chunks
-            msg_ids = list(range(batch_start, batch_end + 1))
-            messages = []
-            
-            for i in range(0, len(msg_ids), 100):
-                chunk = msg_ids[i:i+100]
-                chunk_msgs = await client.get_messages(src_id, chunk, **get_kwargs)
-                if chunk_msgs is None:
-                    continue
-                if not isinstance(chunk_msgs, list):
-                    chunk_msgs = [chunk_msgs]
-                messages.extend([m for m in chunk_msgs if m and not m.empty])
-            
-            # Group by media_group_id (albums) or individual messages
-            groups = {}
-            for message in messages:
-                # Use media_group_id for albums, or unique ID for single messages
-                group_id = message.media_group_id if message.media_group_id else f"single_{message.id}"
-                if group_id not in groups:
-                    groups[group_id] = []
-                groups[group_id].append(message)
-            
-            total_groups = len(groups)
-            
-            with tqdm(total=total_groups, desc=Fore.BLUE + Style.BRIGHT + "Transferring", unit="group",
-                      bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]" + Style.RESET_ALL) as pbar:
-                for group_id, msgs in groups.items():
-                    # Sort messages by ID to maintain order in albums
-                    msgs.sort(key=lambda m: m.id)
-                    await process_group(client, msgs, dest_chats, src_title, src_topic)
-                    pbar.update(1)
-            
-            print(Fore.CYAN + Style.BRIGHT + f"Finished batch {batch_start} → {batch_end}: {total_groups} groups processed." + Style.RESET_ALL)
-            await asyncio.sleep(random.uniform(5.0, 10.0))
+        queue = asyncio.Queue()
+        queued_sources = set()
+        first_sources = workers_setup[0][1]
+        for source_index, (src_id, src_topic, src_title) in enumerate(first_sources):
+            if not src_id:
+                continue
+            print(Fore.CYAN + Style.BRIGHT + f"\nSource: {src_id} (topic: {src_topic or 'general'}, title: {src_title})" + Style.RESET_ALL)
+            id_range = ask_range(src_id)
+            if not id_range:
+                continue
+            start_id, end_id = id_range
+            queued_sources.add(source_index)
+            for shard_start in range(start_id, end_id + 1, SHARD_SIZE):
+                queue.put_nowait((source_index, shard_start, min(shard_start + SHARD_SIZE - 1, end_id), 0))
         
-        print(Fore.CYAN + Style.BRIGHT + f"Finished source '{src_title}'." + Style.RESET_ALL)
+        print(Fore.YELLOW + Style.BRIGHT + f"{queue.qsize()} shards of up to {SHARD_SIZE} messages queued." + Style.RESET_ALL)
+        workers = [
+            asyncio.create_task(shard_worker(client, sources, dest_chats, queue))
+            for client, sources, dest_chats in workers_setup
+            if all(sources[source_index][0] for source_index in queued_sources)
+        ]
+        if not workers:
+            print(Fore.RED + Style.BRIGHT + "No account can read every source." + Style.RESET_ALL)
+            return
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        print(Fore.CYAN + Style.BRIGHT + "Multi-account transfer finished." + Style.RESET_ALL)
+    finally:
+        for client in clients:
+            try:
+                await client.stop()
+            except Exception:
+                pass
+
+def finish_run():
+    journal.close()
+    media_cache.close()
+    local_archive.close()
+    metrics.print_summary()
+    metrics.export()
+    metrics.close()
 
 async def main():
     print(
@@ -443,22 +2544,37 @@ async def main():
     + Style.RESET_ALL
 )
 
-    print(Fore.CYAN + Style.BRIGHT + "1. Login (Create new session)\n2. Start Transfer\n" + Style.RESET_ALL)
-    choice = input(Fore.GREEN + Style.BRIGHT + "Choose (1 or 2): " + Style.RESET_ALL).strip()
+    print(Fore.CYAN + Style.BRIGHT + "1. Login (Create new session)\n2. Start Transfer\n3. Multi-Account Transfer (all sessions)\n4. Live Follow (mirror new posts)\n" + Style.RESET_ALL)
+    choice = input(Fore.GREEN + Style.BRIGHT + "Choose (1, 2, 3 or 4): " + Style.RESET_ALL).strip()
     
     if choice == "1":
         await create_session()
-    elif choice == "2":
+    elif choice in ("2", "4"):
         session_name = await list_sessions()
         if not session_name:
             return
         
-        client = Client(name=session_name, api_id=API_ID, api_hash=API_HASH, workdir="sessions")
+        # sleep_threshold=0: every FloodWait reaches the rate limiter instead of being slept inside pyrogram
+        client = Client(name=session_name, api_id=API_ID, api_hash=API_HASH, workdir="sessions",
+                        max_concurrent_transmissions=max(1, DOWNLOAD_CONNECTIONS), sleep_threshold=0)
+        await metrics.serve()
         async with client:
-            me = await client.get_me()
+            me = await retry_floodwait(client.get_me)
             print(Fore.GREEN + Style.BRIGHT +
                   f"Logged in successfully as {me.first_name} {'@' + me.username if me.username else ''}. Starting transfer...\n" + Style.RESET_ALL)
-            await transfer_content(client)
+            try:
+                if choice == "2":
+                    await transfer_content(client)
+                else:
+                    await follow_sources(client)
+            finally:
+                finish_run()
+    elif choice == "3":
+        await metrics.serve()
+        try:
+            await multi_account_transfer()
+        finally:
+            finish_run()
     else:
         print(Fore.RED + "Invalid option." + Style.RESET_ALL)
 